@@ -0,0 +1,142 @@
+#Benchmark of the Matrix class storage backends
+#Usage: python benchmark.py [--sizes 2 4 8 ...]
+
+import argparse
+import random
+import timeit
+
+import Matrix as m
+
+#The matrix sizes (nxn) to benchmark
+DEFAULT_SIZES = [2, 4, 8, 16, 32, 64, 128, 256, 500]
+
+#Creates a random (nxn) grid
+def random_grid(n, seed=0):
+    rand = random.Random(seed)
+    return [[rand.uniform(-1, 1) for j in range(n)] for i in range(n)]
+
+#Times a function, returns the best time of a single call in seconds
+def time_call(function, min_time=0.2, repeat=3):
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    #Big sizes take long enough to be timed only once
+    if elapsed >= min_time * 10:
+        return elapsed / number
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+#Compares the list and numpy backends for the Kalman hot spots (*, T() and +)
+def benchmark_backends(sizes=DEFAULT_SIZES):
+    print("{:>6} {:>6} {:>14} {:>14} {:>10}".format("size", "op", "list (s)", "numpy (s)", "speedup"))
+    results = []
+    for n in sizes:
+        grid = random_grid(n)
+        a_list, b_list = m.Matrix(grid, 'list'), m.Matrix(random_grid(n, 1), 'list')
+        a_np, b_np = a_list.to_backend('numpy'), b_list.to_backend('numpy')
+
+        operations = [
+            ('mul', lambda: a_list * b_list, lambda: a_np * b_np),
+            ('T', lambda: a_list.T(), lambda: a_np.T()),
+            ('add', lambda: a_list + b_list, lambda: a_np + b_np),
+        ]
+        for name, list_op, numpy_op in operations:
+            t_list = time_call(list_op)
+            t_numpy = time_call(numpy_op)
+            results.append((n, name, t_list, t_numpy))
+            print("{:>6} {:>6} {:>14.3e} {:>14.3e} {:>9.1f}x".format(n, name, t_list, t_numpy, t_list / t_numpy))
+    return results
+
+#The previous multiplication (full transpose then a triple loop through __getitem__), kept as a reference
+def reference_mul(a, b):
+    other_T = b.T()
+    result = m.zeroes(a.h, b.w, 'list')
+    for i, row in enumerate(a.g):
+        for j, col in enumerate(other_T):
+            dot_sum = 0
+            for ind in range(len(row)):
+                dot_sum += (row[ind] * col[ind])
+            result[i][j] = dot_sum
+    return result
+
+#Size sweep of the multiplication kernel against the reference triple loop
+def benchmark_mul_kernel(sizes=DEFAULT_SIZES):
+    print("{:>6} {:>16} {:>14} {:>10}".format("size", "reference (s)", "kernel (s)", "speedup"))
+    results = []
+    for n in sizes:
+        a, b = m.Matrix(random_grid(n), 'list'), m.Matrix(random_grid(n, 1), 'list')
+        t_reference = time_call(lambda: reference_mul(a, b))
+        t_kernel = time_call(lambda: a * b)
+        results.append((n, t_reference, t_kernel))
+        print("{:>6} {:>16.3e} {:>14.3e} {:>9.2f}x".format(n, t_reference, t_kernel, t_reference / t_kernel))
+    return results
+
+#One step of the demo Kalman filter written with the operators (new matrices every operation)
+def kalman_step(F, Q, H, R, I, x, P, z):
+    x_prime = F * x
+    P_prime = F * P * F.T() + Q
+    y = z - H * x_prime
+    S = H * P_prime * H.T() + R
+    K = P_prime * H.T() * S.inverse()
+    return x_prime + K * y, (I - K * H) * P_prime
+
+#The same step written with output buffers, no matrix is allocated once the buffers exist
+def make_buffered_kalman_step(F, Q, H, R, I, backend):
+    n, k = F.h, H.h
+    Ft, Ht = F.T(), H.T()
+    x_prime, Hx, y, Ky = m.zeroes(n, 1, backend), m.zeroes(k, 1, backend), m.zeroes(k, 1, backend), m.zeroes(n, 1, backend)
+    FP, P_prime, KH, IKH = [m.zeroes(n, n, backend) for i in range(4)]
+    PHt, K = m.zeroes(n, k, backend), m.zeroes(n, k, backend)
+    S, S_inv = m.zeroes(k, k, backend), m.zeroes(k, k, backend)
+
+    def step(x, P, z):
+        F.mul(x, out=x_prime)
+        F.mul(P, out=FP)
+        FP.mul(Ft, out=P_prime)
+        P_prime.add(Q, out=P_prime)
+        H.mul(x_prime, out=Hx)
+        z.sub(Hx, out=y)
+        P_prime.mul(Ht, out=PHt)
+        H.mul(PHt, out=S)
+        S.add(R, out=S)
+        S_inv[0][0] = 1.0 / S[0][0]
+        PHt.mul(S_inv, out=K)
+        K.mul(y, out=Ky)
+        x_prime.add(Ky, out=x)
+        K.mul(H, out=KH)
+        I.sub(KH, out=IKH)
+        IKH.mul(P_prime, out=P)
+        return x, P
+
+    return step
+
+#Compares the allocating Kalman step with the buffered one
+def benchmark_kalman_step(backends=m.BACKENDS):
+    print("{:>8} {:>16} {:>14} {:>10}".format("backend", "allocating (s)", "buffered (s)", "speedup"))
+    results = []
+    for backend in backends:
+        dt = 0.05
+        F = m.Matrix([[1, dt], [0, 1]], backend)
+        Q = m.Matrix([[dt ** 4 / 4, dt ** 3 / 2], [dt ** 3 / 2, dt ** 2]], backend)
+        H, R, I = m.Matrix([[1, 0]], backend), m.Matrix([[0.0225]], backend), m.identity(2, backend)
+        x, P, z = m.Matrix([[0], [0]], backend), m.Matrix([[5, 0], [0, 5]], backend), m.Matrix([[1.0]], backend)
+
+        step = make_buffered_kalman_step(F, Q, H, R, I, backend)
+        t_allocating = time_call(lambda: kalman_step(F, Q, H, R, I, x, P, z))
+        t_buffered = time_call(lambda: step(x, P, z))
+        results.append((backend, t_allocating, t_buffered))
+        print("{:>8} {:>16.3e} {:>14.3e} {:>9.2f}x".format(backend, t_allocating, t_buffered, t_allocating / t_buffered))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Matrix class')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--only', choices=['backends', 'mul', 'kalman'], default=None,
+                        help='run a single benchmark')
+    args = parser.parse_args()
+
+    if args.only in (None, 'backends'):
+        benchmark_backends(args.sizes)
+    if args.only in (None, 'mul'):
+        benchmark_mul_kernel(args.sizes)
+    if args.only in (None, 'kalman'):
+        benchmark_kalman_step()
@@ -108,4 +108,83 @@ def generate_data(initial_distance, initial_velocity, final_velocity, accelerati
 	return time_groundtruth, distance_groundtruth, velocity_groundtruth, acceleration_groundtruth
 
 def generate_lidar(distance_groundtruth, standard_deviation):
-	return distance_groundtruth + np.random.normal(0, standard_deviation, len(distance_groundtruth))
\ No newline at end of file
+	return distance_groundtruth + np.random.normal(0, standard_deviation, len(distance_groundtruth))
+
+# Vectorised version of generate_data
+#
+# Each phase length is computed from its stopping condition and the time, velocity,
+# acceleration and distance arrays are built with array operations. The values are
+# accumulated in the same order as the loops above, so the output matches
+# generate_data sample for sample (as numpy arrays instead of lists).
+
+def generate_data_vectorized(initial_distance, initial_velocity, final_velocity, acceleration,
+	stopped_time, reverse_time, measurement_time_interval):
+
+	dt = measurement_time_interval
+
+	# convert acceleration to km/h^2 and get the velocity change of one time step
+	acceleration_kmh = acceleration * 1e-3 * math.pow(60 * 60, 2)
+	velocity_step = acceleration_kmh * (dt / (1000 * 60 * 60))
+
+	# Phase one: moving forward and decelerating until velocity = 0
+	phase_one = _accumulate_while(initial_velocity, velocity_step, lambda v: v > 0,
+		initial_velocity / -velocity_step if velocity_step < 0 else 0)
+
+	# Phase two: idle for stopped_time
+	idle_times = _accumulate_while(dt, dt, lambda t: t < stopped_time, stopped_time / dt)
+
+	# Phase three: accelerating in reverse until reaching final_velocity
+	phase_three = _accumulate_while(0, velocity_step, lambda v: v > final_velocity,
+		final_velocity / velocity_step if velocity_step < 0 else 0)
+
+	# Phase four: constant velocity in reverse for reverse_time
+	noaccel_times = _accumulate_while(dt, dt, lambda t: t < reverse_time, reverse_time / dt)
+	velocity_before_phase_four = np.concatenate((phase_one, np.zeros(len(idle_times)), phase_three))
+
+	velocity_groundtruth = np.concatenate((velocity_before_phase_four,
+		np.full(len(noaccel_times), velocity_before_phase_four[-1])))
+
+	acceleration_groundtruth = np.concatenate((
+		np.full(len(phase_one), acceleration_kmh), np.zeros(len(idle_times)),
+		np.full(len(phase_three), acceleration_kmh), np.zeros(len(noaccel_times))))
+
+	time_groundtruth = _accumulate(0, dt, len(velocity_groundtruth))
+
+	# Calculate distance ground truth
+	# x[i+1] = (x[i] + velocity * time_difference) + 0.5 * acceleration * time_difference^2
+	time_difference = np.diff(time_groundtruth) / 1000
+	velocity = 1000 * velocity_groundtruth[:-1] / (60 * 60)
+	acceleration = 1000 * acceleration_groundtruth[:-1] / math.pow(60 * 60, 2)
+
+	# Interleaving both terms keeps the order of the additions of the loop
+	terms = np.empty(2 * len(time_difference) + 1)
+	terms[0] = initial_distance
+	terms[1::2] = velocity * time_difference
+	terms[2::2] = 0.5 * acceleration * time_difference ** 2
+	distance_groundtruth = np.cumsum(terms)[::2]
+
+	return time_groundtruth, distance_groundtruth, velocity_groundtruth, acceleration_groundtruth
+
+# Returns [start, start + step, start + 2 * step, ...] with count values, accumulated one
+# step at a time like the += of the loops
+def _accumulate(start, step, count):
+	if count < 1:
+		return np.array([start])[:0]
+	return np.cumsum(np.concatenate(([start], np.full(count - 1, step))))
+
+# Returns the accumulated sequence starting at start up to (not including) the first value
+# where keep(value) is False. estimate is the expected length, it only sets the initial size
+def _accumulate_while(start, step, keep, estimate):
+	if not keep(start):
+		return _accumulate(start, step, 0)
+	# The sequence has to move towards the end of the phase (the loop version would never stop)
+	if step == 0 or keep(start + step * (abs(estimate) + 2) * 4):
+		raise ValueError('Invalid parameters, the vehicle never reaches the end of a phase')
+
+	count = int(abs(estimate)) + 2
+	while True:
+		values = _accumulate(start, step, count)
+		stop = np.flatnonzero(~keep(values))
+		if len(stop):
+			return values[:stop[0]]
+		count *= 2
@@ -0,0 +1,232 @@
+# Kalman filters for the constant velocity model used in kalman_filter_demo.py
+#
+# The state of a track is [distance, velocity] and it is advanced with
+# F = [[1, dt], [0, 1]] and the process noise Q of a random acceleration.
+
+import functools
+import math
+import numbers
+
+import numpy as np
+
+import Matrix as m
+
+
+#Transition matrix for an interval of delta_t seconds
+def F_matrix(delta_t):
+    return m.Matrix([[1, delta_t], [0, 1]])
+
+#Process noise matrix for an interval of delta_t seconds
+def Q_matrix(delta_t, variance):
+    t4 = math.pow(delta_t, 4)
+    t3 = math.pow(delta_t, 3)
+    t2 = math.pow(delta_t, 2)
+    
+    return variance * m.Matrix([[(1/4)*t4, (1/2)*t3], [(1/2)*t3, t2]])
+
+#Maximum number of (F, Q) pairs kept by transition_matrices
+MATRIX_CACHE_SIZE = 128
+
+@functools.lru_cache(maxsize=MATRIX_CACHE_SIZE)
+def _transition_matrices(delta_t, variance, backend):
+    F, Q = F_matrix(delta_t), Q_matrix(delta_t, variance)
+    #The matrices are shared by every caller, make the numpy ones read only
+    if backend == 'numpy':
+        F.g.flags.writeable = False
+        Q.g.flags.writeable = False
+    return F, Q
+
+#Returns the (F, Q) matrices for an interval of delta_t seconds from a bounded LRU cache
+#Fixed rate streams (e.g. lidar every 50 ms) build them only once, any other interval is
+#still computed exactly. The cached matrices are shared, they must not be changed in place
+def transition_matrices(delta_t, variance):
+    return _transition_matrices(delta_t, variance, m.get_backend())
+
+#Hits, misses and size of the transition matrices cache
+def matrix_cache_info():
+    return _transition_matrices.cache_info()
+
+#Empties the transition matrices cache (and resets its counters)
+def clear_matrix_cache():
+    _transition_matrices.cache_clear()
+
+
+#Kalman filter of a single track that consumes measurements one at a time
+class KalmanFilter(object):
+
+    #x, P: initial state and covariance (Matrix)
+    #H, R: measurement matrix and measurement noise (Matrix)
+    #time_scale: number of time units in a second (the lidar timestamps are in milliseconds)
+    def __init__(self, x, P, H, R, acceleration_variance, time_scale=1000.0):
+        self.x = x
+        self.P = P
+        self.H = H
+        self.R = R
+        self.acceleration_variance = acceleration_variance
+        self.time_scale = time_scale
+
+        self.I = m.identity(x.h)
+        #Time of the last measurement
+        self.t = None
+
+    #Prediction step over an interval of delta_t seconds
+    def predict(self, delta_t):
+        F, Q = transition_matrices(delta_t, self.acceleration_variance)
+
+        self.x = F * self.x
+        self.P = F * self.P * F.T() + Q
+        return self.x
+
+    #Measurement update step, z is a number, a list or a column Matrix
+    def update(self, z):
+        if isinstance(z, numbers.Number):
+            z = m.Matrix([[z]])
+        elif not isinstance(z, m.Matrix):
+            z = m.Matrix([[value] for value in z])
+
+        y = z - self.H * self.x
+        S = self.H * self.P * self.H.T() + self.R
+        # K = P * H^T * S^-1, computed by solving S^T * K^T = (P * H^T)^T instead of inverting S
+        K = S.T().solve((self.P * self.H.T()).T()).T()
+        self.x = self.x + K * y
+        self.P = (self.I - K * self.H) * self.P
+        return self.x
+
+    #Processes the measurement z taken at time t and returns the state estimate
+    #The first measurement only sets the time, there is no interval to predict over yet
+    def step(self, t, z):
+        if self.t is None:
+            self.t = t
+            return self.x
+
+        self.predict((t - self.t) / self.time_scale)
+        self.t = t
+        return self.update(z)
+
+    #Generator filtering an iterable of (t, z) measurements, yields (t, state estimate) for
+    #every measurement after the first one. Only the current state is kept in memory, so it
+    #can run over a stream or a log file of any length
+    def iter_filter(self, measurements):
+        for t, z in measurements:
+            first = self.t is None
+            x = self.step(t, z)
+            if not first:
+                yield t, x
+
+
+#Transition matrices of N tracks, delta_t is a number or an array of N intervals (seconds)
+def F_batch(delta_t, n_tracks):
+    dt = np.broadcast_to(np.asarray(delta_t, dtype=np.float64), (n_tracks,))
+
+    F = np.zeros((n_tracks, 2, 2))
+    F[:, 0, 0] = 1
+    F[:, 0, 1] = dt
+    F[:, 1, 1] = 1
+    return F
+
+#Process noise matrices of N tracks, delta_t is a number or an array of N intervals (seconds)
+def Q_batch(delta_t, variance, n_tracks):
+    dt = np.broadcast_to(np.asarray(delta_t, dtype=np.float64), (n_tracks,))
+    t2 = dt ** 2
+    t3 = dt ** 3
+    t4 = dt ** 4
+
+    Q = np.empty((n_tracks, 2, 2))
+    Q[:, 0, 0] = (1/4) * t4
+    Q[:, 0, 1] = (1/2) * t3
+    Q[:, 1, 0] = (1/2) * t3
+    Q[:, 1, 1] = t2
+    return variance * Q
+
+
+#Kalman filter running N tracks at once
+#States are stored as an (N, n) array and covariances as an (N, n, n) array,
+#so each predict / update call advances every track in a single vectorised step
+class BatchKalmanFilter(object):
+
+    #x: initial states (N, n)
+    #P: initial covariance, either one (n, n) matrix shared by all tracks or (N, n, n)
+    #H: measurement matrix (m, n) and R: measurement noise (m, m), shared by all tracks
+    #F and Q: functions building the (N, n, n) transition and process noise matrices
+    #         from delta_t, defaults to the constant velocity model
+    def __init__(self, x, P, H, R, acceleration_variance, F=F_batch, Q=Q_batch):
+        self.x = np.array(x, dtype=np.float64)
+        if self.x.ndim != 2:
+            raise ValueError('x must be an (N, n) array of states')
+        n_tracks, n = self.x.shape
+
+        P = np.asarray(P, dtype=np.float64)
+        if P.shape not in ((n, n), (n_tracks, n, n)):
+            raise ValueError('P must be an (n, n) or (N, n, n) array')
+        self.P = np.array(np.broadcast_to(P, (n_tracks, n, n)))
+
+        self.H = np.atleast_2d(np.asarray(H, dtype=np.float64))
+        self.R = np.atleast_2d(np.asarray(R, dtype=np.float64))
+        if self.H.shape[1] != n or self.R.shape != (self.H.shape[0], self.H.shape[0]):
+            raise ValueError('H must be (m, n) and R must be (m, m)')
+
+        self.acceleration_variance = acceleration_variance
+        self.F = F
+        self.Q = Q
+        self._I = np.eye(n)
+
+    #Number of tracks
+    def __len__(self):
+        return self.x.shape[0]
+
+    #Selects the tracks an operation applies to (all of them if mask is None)
+    def _select(self, mask):
+        if mask is None:
+            return slice(None)
+        mask = np.asarray(mask)
+        if mask.dtype == bool:
+            if mask.shape != (len(self),):
+                raise ValueError('mask must have one entry per track')
+            return np.flatnonzero(mask)
+        return mask
+
+    #Prediction step, delta_t (seconds) is a number or an array with one interval per track
+    #Only the tracks in mask (boolean array or indices) are advanced when it is given
+    def predict(self, delta_t, mask=None):
+        idx = self._select(mask)
+        x, P = self.x[idx], self.P[idx]
+        n_tracks = x.shape[0]
+
+        dt = np.asarray(delta_t, dtype=np.float64)
+        if dt.ndim == 1 and mask is not None:
+            dt = dt[idx]
+
+        F = self.F(dt, n_tracks)
+        Q = self.Q(dt, self.acceleration_variance, n_tracks)
+
+        self.x[idx] = np.einsum('kij,kj->ki', F, x)
+        self.P[idx] = F @ P @ F.transpose(0, 2, 1) + Q
+        return self.x
+
+    #Measurement update step, z is an (N, m) array (or (N,) for a single measurement)
+    #Tracks outside mask (boolean array or indices) got no measurement and keep their prediction
+    def update(self, z, mask=None):
+        idx = self._select(mask)
+        z = np.asarray(z, dtype=np.float64)
+        if z.ndim == 1:
+            z = z[:, np.newaxis]
+        if z.shape != (len(self), self.H.shape[0]):
+            raise ValueError('z must be an (N, m) array with one row per track')
+
+        x, P = self.x[idx], self.P[idx]
+        H, Ht = self.H, self.H.T
+
+        y = z[idx] - x @ Ht
+        PHt = P @ Ht
+        S = H @ PHt + self.R
+        #K = P * H^T * S^-1, solved as S^T * K^T = (P * H^T)^T
+        K = np.linalg.solve(S.transpose(0, 2, 1), PHt.transpose(0, 2, 1)).transpose(0, 2, 1)
+
+        self.x[idx] = x + np.einsum('kij,kj->ki', K, y)
+        self.P[idx] = (self._I - K @ H) @ P
+        return self.x
+
+    #Prediction followed by an update
+    def step(self, delta_t, z, mask=None):
+        self.predict(delta_t)
+        return self.update(z, mask)
@@ -61,6 +61,7 @@ import matplotlib.pyplot as plt
 import matplotlib
 import datagenerator
 import Matrix as m
+from kalman_filter import KalmanFilter
 
 matplotlib.rcParams.update({'font.size': 16})
 
@@ -178,17 +179,10 @@ lidar_variance = math.pow(lidar_standard_deviation, 2)
 
 H = m.Matrix([[1, 0]])
 R = m.Matrix([[lidar_variance]])
-I = m.identity(2)
 
-def F_matrix(delta_t):
-    return m.Matrix([[1, delta_t], [0, 1]])
-
-def Q_matrix(delta_t, variance):
-    t4 = math.pow(delta_t, 4)
-    t3 = math.pow(delta_t, 3)
-    t2 = math.pow(delta_t, 2)
-    
-    return variance * m.Matrix([[(1/4)*t4, (1/2)*t3], [(1/2)*t3, t2]])
+# The prediction uses the transition matrix F and the process noise Q of the
+# constant velocity model (F_matrix and Q_matrix in kalman_filter.py)
+kalman = KalmanFilter(x_initial, P_initial, H, R, acceleration_variance)
 
 
 # ### Run the Kalman filter
@@ -202,37 +196,19 @@ def Q_matrix(delta_t, variance):
 
 # Kalman Filter Implementation
 
-x = x_initial
-P = P_initial
-
 x_result = []
 time_result = []
 v_result = []
 
-
-for i in range(len(lidar_measurements) - 1):
-        
-    # calculate time that has passed between lidar measurements
-    delta_t = (lidar_time[i + 1] - lidar_time[i]) / 1000.0
-
-    # Prediction Step - estimates how far the object traveled during the time interval
-    F = F_matrix(delta_t)
-    Q = Q_matrix(delta_t, acceleration_variance)
-    
-    x_prime = F * x
-    P_prime = F * P * F.T() + Q
-    
-    # Measurement Update Step - updates belief based on lidar measurement
-    y = m.Matrix([[lidar_measurements[i + 1]]]) - H * x_prime
-    S = H * P_prime * H.T() + R
-    K = P_prime * H.T() * S.inverse()
-    x = x_prime + K * y
-    P = (I - K * H) * P_prime
+# iter_filter consumes the (time, measurement) pairs one at a time. For every measurement it runs
+# the prediction step (how far the object traveled during the time interval) and the measurement
+# update step (updates belief based on the lidar measurement), then yields the new estimate
+for t, x in kalman.iter_filter(zip(lidar_time, lidar_measurements)):
 
     # Store distance and velocity belief and current time
     x_result.append(x[0][0])
     v_result.append(3600.0/1000 * x[1][0])
-    time_result.append(lidar_time[i+1])
+    time_result.append(t)
     
 result = pd.DataFrame(
     {'time': time_result,
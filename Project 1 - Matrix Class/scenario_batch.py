@@ -0,0 +1,124 @@
+# Monte-Carlo scenario generator for offline Kalman filter evaluation
+#
+# A scenario is one run of datagenerator.generate_data_vectorized with lidar noise on top,
+# described by the parameters in PARAMETERS. Batches of scenarios are generated on a process
+# pool and written to a single compressed columnar file (.npz):
+#
+#   parameters  (S, 5)  one row of PARAMETERS per scenario
+#   offsets     (S + 1) scenario i owns the samples offsets[i]:offsets[i + 1] of every column
+#   time, distance, velocity, acceleration, lidar   the samples of all scenarios, concatenated
+#
+# Usage: python scenario_batch.py --samples 1000 --workers 4 --output scenarios.npz
+
+import argparse
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import datagenerator
+
+#Names of the scenario parameters (columns of the parameters array)
+PARAMETERS = ('initial_velocity', 'acceleration', 'stopped_time', 'reverse_time', 'noise_std')
+
+#Columns holding the samples of the scenarios
+COLUMNS = ('time', 'distance', 'velocity', 'acceleration', 'lidar')
+
+#Default ranges (low, high) used by sample_scenarios
+DEFAULT_RANGES = {
+    'initial_velocity': (20, 120),   # km/h
+    'acceleration': (-12, -2),       # m/s^2
+    'stopped_time': (0, 10000),      # milliseconds
+    'reverse_time': (0, 10000),      # milliseconds
+    'noise_std': (0.05, 0.5),        # meters
+}
+
+
+#Every combination of the given parameter values, returns an (S, 5) array
+def scenario_grid(initial_velocity, acceleration, stopped_time, reverse_time, noise_std):
+    return np.array(list(itertools.product(initial_velocity, acceleration, stopped_time,
+                                           reverse_time, noise_std)), dtype=np.float64)
+
+#n scenarios drawn uniformly from ranges (a dict of parameter name -> (low, high)), returns an (n, 5) array
+def sample_scenarios(n, ranges=None, seed=0):
+    ranges = dict(DEFAULT_RANGES, **(ranges or {}))
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(*ranges[name], size=n) for name in PARAMETERS])
+
+
+#Generates one scenario, the lidar noise comes from its own seed
+def _generate_scenario(task):
+    parameters, seed, fixed = task
+    initial_velocity, acceleration, stopped_time, reverse_time, noise_std = parameters
+
+    groundtruth = datagenerator.generate_data_vectorized(
+        fixed['initial_distance'], initial_velocity, fixed['final_velocity'], acceleration,
+        stopped_time, reverse_time, fixed['measurement_time_interval'])
+    distance = groundtruth[1]
+
+    rng = np.random.default_rng(seed)
+    lidar = distance + rng.normal(0, noise_std, len(distance))
+    return groundtruth + (lidar,)
+
+#Generates the scenarios described by parameters (an (S, 5) array) on a pool of workers
+#Each scenario gets a seed spawned from seed, so the result is the same for any number of workers
+#Returns a dict with the parameters, offsets and sample columns (values other than time stored as dtype)
+def generate_scenarios(parameters, workers=None, seed=0, initial_distance=5, final_velocity=-10,
+                       measurement_time_interval=50, dtype=np.float32, chunksize=16):
+    parameters = np.atleast_2d(np.asarray(parameters, dtype=np.float64))
+    if parameters.shape[1] != len(PARAMETERS):
+        raise ValueError('parameters must have one column for each of ' + str(PARAMETERS))
+
+    fixed = {'initial_distance': initial_distance, 'final_velocity': final_velocity,
+             'measurement_time_interval': measurement_time_interval}
+    seeds = np.random.SeedSequence(seed).spawn(len(parameters))
+    tasks = [(tuple(row), child, fixed) for row, child in zip(parameters, seeds)]
+
+    if workers == 1:
+        results = list(map(_generate_scenario, tasks))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            results = list(pool.imap(_generate_scenario, tasks, chunksize=chunksize))
+
+    lengths = [len(result[0]) for result in results]
+    scenarios = {
+        'parameters': parameters,
+        'offsets': np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+    }
+    for i, name in enumerate(COLUMNS):
+        #Time stays in float64, float32 milliseconds lose precision after a few hours
+        column_dtype = np.float64 if name == 'time' else dtype
+        scenarios[name] = np.concatenate([result[i] for result in results]).astype(column_dtype)
+    return scenarios
+
+#Writes a batch of scenarios to a single compressed columnar file
+def save_scenarios(filename, scenarios):
+    np.savez_compressed(filename, **scenarios)
+
+#Reads a batch of scenarios written by save_scenarios
+def load_scenarios(filename):
+    with np.load(filename) as data:
+        return {name: data[name] for name in data.files}
+
+#Returns the columns of scenario i as a dict, its parameters are under 'parameters'
+def get_scenario(scenarios, i):
+    start, end = scenarios['offsets'][i], scenarios['offsets'][i + 1]
+    scenario = {name: scenarios[name][start:end] for name in COLUMNS}
+    scenario['parameters'] = dict(zip(PARAMETERS, scenarios['parameters'][i]))
+    return scenario
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a batch of Kalman filter scenarios')
+    parser.add_argument('--samples', type=int, default=1000, help='number of random scenarios')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--interval', type=float, default=50, help='time between measurements (ms)')
+    parser.add_argument('--output', default='scenarios.npz')
+    args = parser.parse_args()
+
+    parameters = sample_scenarios(args.samples, seed=args.seed)
+    scenarios = generate_scenarios(parameters, workers=args.workers, seed=args.seed,
+                                   measurement_time_interval=args.interval)
+    save_scenarios(args.output, scenarios)
+    print("Wrote", args.samples, "scenarios,", scenarios['offsets'][-1], "samples to", args.output)
@@ -1,4 +1,12 @@
+import os
+import tempfile
+
+import numpy as np
+
 import Matrix as m
+import kalman_filter as kf
+import datagenerator
+import scenario_batch
 
 
 def test():
@@ -49,6 +57,24 @@ def test():
         [2.0555556, -0.722222222]
         ])
 
+    m4 = m.Matrix([
+        [2, 1, 1],
+        [1, 3, 2],
+        [1, 0, 0]
+        ])
+
+    m4_inv = m.Matrix([
+        [0, 0, 1],
+        [-2, 1, 3],
+        [3, -1, -5]
+        ])
+
+    b4 = m.Matrix([
+        [4],
+        [5],
+        [6]
+        ])
+
     top_ones = m.Matrix([
         [1,1],
         [0,0],
@@ -62,11 +88,21 @@ def test():
 
     assert equal(-I2, I2_neg), "Error in your __neg__ function"
     assert equal(I2 + I2_neg, zero), "Error in your __add__ function"
+    assert equal(m1 + m1, 2*m1), "Error in your __add__ function for non-square matrices"
     assert equal(m1 * m2, m1_x_m2), "Error in your __mul__ function"
     assert equal(m2 * m1, m2_x_m1), "Error in your __mul__ function"
     assert equal(m3.inverse(), m3_inv), """Error in your inverse function for the 1 x 1 case"""
     assert equal(m1_x_m2.inverse(), m1_m2_inv), """Error in your inverse function for the first 2 x 2 case"""
     assert equal(I2.inverse(), I2), """Error in your inverse function for the second 2 x 2 case"""
+    assert equal(m4.inverse(), m4_inv), """Error in your inverse function for the 3 x 3 case"""
+    assert abs(m4.determinant() - (-1)) < 0.0001, "Error in your determinant function for the 3 x 3 case"
+    assert equal(m4.solve(b4), m4_inv * b4), "Error in your solve function"
+    assert m4.lu() is m4.lu(), "Error: The LU factorisation is not cached"
+    m5 = m.Matrix([[4, 3, 0], [3, 4, 0], [0, 0, 1]])
+    assert abs(m5.determinant() - 7) < 0.0001, "Error in your determinant function for the 3 x 3 case"
+    m5[0][0] = 10
+    assert abs(m5.determinant() - 31) < 0.0001, "Error: The LU factorisation is not updated after indexing"
+    assert equal(m5 * m5.inverse(), m.identity(3)), "Error: The LU factorisation is not updated after indexing"
     assert equal(top_ones.T(), left_ones), "Error in your T function (transpose)"
     assert equal(left_ones.T(), top_ones), "Error in your T function (transpose)"
     
@@ -75,6 +111,19 @@ def test():
     assert (4*m.identity(5))[0][0] == 4, "Error in your __rmul__ function"
     assert (4*m.identity(5)).trace() == 20 , "Error in your trace function"
 
+    buffer = m.zeroes(2,2)
+    assert m1.mul(m2, out=buffer) is buffer and equal(buffer, m1_x_m2), "Error in your mul function with an out buffer"
+    assert equal(top_ones.add(left_ones, out=buffer), top_ones + left_ones), "Error in your add function with an out buffer"
+    assert equal(top_ones.T(out=buffer), left_ones), "Error in your T function with an out buffer"
+    in_place = m.Matrix([[1, 2], [3, 4]])
+    in_place_id = id(in_place)
+    in_place *= top_ones
+    in_place += I2
+    in_place -= I2_neg
+    in_place *= 2
+    assert id(in_place) == in_place_id, "Error: in place operators do not keep the same object"
+    assert equal(in_place, 2*(m.Matrix([[1, 2], [3, 4]]) * top_ones + I2 - I2_neg)), "Error in your in place operators"
+
     assert type(-I2) == type(I2_neg), "Error: Your __neg__ function does not return a Matrix does not return a Matrix"
     assert type(I2 + I2_neg) == type(zero), "Error: Your __add__ function does not return a Matrix"
     assert type(m1 * m2) == type(m1_x_m2), "Error: Your __mul__ function does not return a Matrix"
@@ -87,6 +136,136 @@ def test():
     assert type(top_ones - left_ones.T()) == type(m.zeroes(2,2)), "Error: Your __sub__ function does not return a Matrix"
     print("Congratulations! All tests pass. Your Matrix class is working as expected.")
 
+def test_backends():
+    default = m.get_backend()
+    try:
+        for backend in m.BACKENDS:
+            m.set_backend(backend)
+            test()
+            assert m.identity(2).backend == backend, "Error: The default backend is not used"
+    finally:
+        m.set_backend(default)
+
+    grid = [[1, 2], [3, 4]]
+    m_list = m.Matrix(grid, 'list')
+    m_np = m.Matrix(grid, 'numpy')
+    assert equal(m_list * m_np, m_np * m_list), "Error: list and numpy backends disagree on __mul__"
+    assert equal(m_np.to_backend('list'), m_list), "Error in your to_backend function"
+    assert m_np.get_row(1)[0] == 3 and m_np.get_col(1) == [2, 4], "Error in get_row / get_col for the numpy backend"
+    assert repr(m_np) == repr(m.Matrix([[1.0, 2.0], [3.0, 4.0]])), "Error: __repr__ differs between backends"
+    for result in [m_list + m_np, m_list - m_np, m_list * m_np, m_list.add(m_np, out=m.zeroes(2, 2, 'list'))]:
+        assert result.backend == 'list' and repr(result) == repr(result.to_backend('numpy')), \
+            "Error: mixing backends leaks numpy values into a list matrix"
+    assert equal(m_np + m_list, m_list + m_np) and equal(m_np - m_list, m_list - m_np), "Error: list and numpy backends disagree on __add__ / __sub__"
+
+    #The unrolled kernels (1x1 to 4x4) and the general one give the product of the numpy backend
+    for n, k, p in [(1, 1, 1), (2, 2, 2), (3, 3, 3), (4, 4, 4), (5, 5, 5), (3, 4, 2), (1, 3, 1)]:
+        a_grid = [[(i * k + j) % 7 - 3.5 for j in range(k)] for i in range(n)]
+        b_grid = [[(i * p + j) % 5 - 1.25 for j in range(p)] for i in range(k)]
+        assert equal(m.Matrix(a_grid, 'list') * m.Matrix(b_grid, 'list'), m.Matrix(a_grid, 'numpy') * m.Matrix(b_grid, 'numpy')), \
+            "Error: __mul__ is wrong for a " + str(n) + "x" + str(k) + " by " + str(k) + "x" + str(p) + " product"
+
+def test_batch_kalman_filter():
+    variance, lidar_variance = 50, 0.0225
+    H = m.Matrix([[1, 0]])
+    R = m.Matrix([[lidar_variance]])
+    I = m.identity(2)
+
+    delta_t = [0.05, 0.1, 0.02]
+    measurements = [[1.0, 2.0, 3.0], [1.2, 2.5, 2.9], [1.5, 2.7, 2.7]]
+    has_measurement = [[True, True, True], [True, False, True], [False, True, True]]
+
+    batch = kf.BatchKalmanFilter([[0, 0]] * 3, [[5, 0], [0, 5]], H.g, R.g, variance)
+    for z, mask in zip(measurements, has_measurement):
+        batch.predict(delta_t)
+        batch.update(z, mask)
+
+    for track, dt in enumerate(delta_t):
+        x = m.Matrix([[0], [0]])
+        P = m.Matrix([[5, 0], [0, 5]])
+        F = m.Matrix([[1, dt], [0, 1]])
+        Q = variance * m.Matrix([[dt**4/4, dt**3/2], [dt**3/2, dt**2]])
+        for z, mask in zip(measurements, has_measurement):
+            x = F * x
+            P = F * P * F.T() + Q
+            if mask[track]:
+                y = m.Matrix([[z[track]]]) - H * x
+                S = H * P * H.T() + R
+                K = P * H.T() * S.inverse()
+                x = x + K * y
+                P = (I - K * H) * P
+        assert equal(m.Matrix([list(batch.x[track])]).T(), x), "Error in the BatchKalmanFilter state"
+        assert equal(m.Matrix(batch.P[track].tolist()), P), "Error in the BatchKalmanFilter covariance"
+
+def test_streaming_kalman_filter():
+    times = [0, 50, 100, 170, 220]
+    measurements = [0.5, 1.0, 1.4, 2.1, 2.4]
+
+    stream = kf.KalmanFilter(m.Matrix([[0], [0]]), m.Matrix([[5, 0], [0, 5]]), m.Matrix([[1, 0]]), m.Matrix([[0.0225]]), 50)
+    batch = kf.BatchKalmanFilter([[0, 0]], [[5, 0], [0, 5]], [[1, 0]], [[0.0225]], 50)
+
+    estimates = stream.iter_filter(iter(zip(times, measurements)))
+    count = 0
+    for i, (t, x) in enumerate(estimates, start=1):
+        batch.step((times[i] - times[i - 1]) / 1000.0, [measurements[i]])
+        assert t == times[i], "Error: iter_filter yields the wrong time"
+        assert equal(x, m.Matrix(batch.x.T.tolist())), "Error in the KalmanFilter estimate"
+        count += 1
+    assert count == len(times) - 1, "Error: iter_filter should yield every measurement after the first one"
+
+def test_transition_matrices_cache():
+    kf.clear_matrix_cache()
+    F, Q = kf.transition_matrices(0.05, 50)
+    assert equal(F, kf.F_matrix(0.05)) and equal(Q, kf.Q_matrix(0.05, 50)), "Error in the cached transition matrices"
+    assert kf.transition_matrices(0.05, 50)[0] is F, "Error: the transition matrices are not cached"
+    assert equal(kf.transition_matrices(0.07, 50)[0], kf.F_matrix(0.07)), "Error in the cached transition matrices"
+    info = kf.matrix_cache_info()
+    assert (info.hits, info.misses) == (1, 2), "Error in the cache counters"
+
+def test_generate_data_vectorized():
+    for parameters in [(5, 100, -10, -10, 5000, 5000, 50), (0, 37.3, -7.7, -3.3, 1234, 987, 13.7)]:
+        expected = datagenerator.generate_data(*parameters)
+        result = datagenerator.generate_data_vectorized(*parameters)
+        for expected_values, values in zip(expected, result):
+            assert list(values) == expected_values, "Error: generate_data_vectorized does not match generate_data"
+
+def test_scenario_batch():
+    parameters = np.vstack([scenario_batch.scenario_grid([30, 60], [-8], [0, 1000], [500], [0.1]),
+                            scenario_batch.sample_scenarios(3, {'stopped_time': (0, 2000), 'reverse_time': (0, 2000)}, seed=1)])
+    scenarios = scenario_batch.generate_scenarios(parameters, workers=1, seed=7)
+    parallel = scenario_batch.generate_scenarios(parameters, workers=2, seed=7, chunksize=1)
+    assert sorted(scenarios) == sorted(parallel) and all(np.array_equal(scenarios[name], parallel[name]) for name in scenarios), \
+        "Error: generate_scenarios depends on the number of workers"
+    reseeded = scenario_batch.generate_scenarios(parameters, workers=1, seed=8)
+    assert not np.array_equal(scenarios['lidar'], reseeded['lidar']), "Error: the lidar noise does not depend on the seed"
+
+    offsets = scenarios['offsets']
+    assert offsets[0] == 0 and offsets[-1] == len(scenarios['time']), "Error: the offsets do not cover the samples"
+    for i, row in enumerate(parameters):
+        initial_velocity, acceleration, stopped_time, reverse_time, noise_std = row
+        groundtruth = datagenerator.generate_data_vectorized(5, initial_velocity, -10, acceleration, stopped_time, reverse_time, 50)
+        scenario = scenario_batch.get_scenario(scenarios, i)
+        assert offsets[i + 1] - offsets[i] == len(groundtruth[0]), "Error: wrong number of samples in the offsets"
+        assert np.array_equal(scenario['time'], groundtruth[0]), "Error: get_scenario returns the samples of another scenario"
+        assert np.allclose(scenario['distance'], groundtruth[1], atol=1e-3), "Error in the scenario distances"
+        assert list(scenario['parameters'].values()) == list(row), "Error in the scenario parameters"
+    assert scenarios['time'].dtype == np.float64 and scenarios['lidar'].dtype == np.float32, "Error in the column dtypes"
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'scenarios.npz')
+        scenario_batch.save_scenarios(filename, scenarios)
+        loaded = scenario_batch.load_scenarios(filename)
+    assert sorted(loaded) == sorted(scenarios), "Error: load_scenarios returns other columns"
+    for name in scenarios:
+        assert loaded[name].dtype == scenarios[name].dtype and np.array_equal(loaded[name], scenarios[name]), \
+            "Error: the " + name + " column changed after save and load"
+
+    try:
+        scenario_batch.generate_scenarios(parameters[:, :4], workers=1)
+        assert False, "Error: generate_scenarios accepts parameters with a missing column"
+    except ValueError:
+        pass
+
 def equal(m1, m2):
 
     if len(m1.g) != len(m2.g): return False
@@ -97,4 +276,12 @@ def equal(m1, m2):
                 return False
     return True
 
-test()
\ No newline at end of file
+# generate_scenarios starts worker processes, which import this module again where processes are spawned
+if __name__ == '__main__':
+    test()
+    test_backends()
+    test_batch_kalman_filter()
+    test_streaming_kalman_filter()
+    test_transition_matrices_cache()
+    test_generate_data_vectorized()
+    test_scenario_batch()
\ No newline at end of file
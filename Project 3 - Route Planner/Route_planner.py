@@ -11,7 +11,9 @@
 
 # Run this cell first!
 
-from helpers import Map, load_map_10, load_map_40, show_map
+from helpers import Map, CSRGraph, load_map_10, load_map_40, show_map
+import heapq
+import itertools
 import math
 
 
@@ -125,11 +127,17 @@ show_map(map_40, start=5, goal=34, path=[5,16,37,12,34])
 # without problems
 class PathPlanner():
     """Construct a PathPlanner Object"""
-    def __init__(self, M, start=None, goal=None):
-        """ """
+    def __init__(self, M, start=None, goal=None, mode="unidirectional", landmarks=None):
+        """ mode is "unidirectional" (A* from start, the default) or "bidirectional" (opt-in A* from both
+        start and goal, same path costs but more nodes expanded on the maps measured, see run_bidirectional_search)
+        landmarks: optional landmarks.Landmarks of M, sharpening the heuristic"""
         self.map = M
         self.start= start
         self.goal = goal
+        self.mode = mode
+        self.landmarks = landmarks
+        # Number of nodes taken out of the open set(s) by the last search
+        self.expanded = 0
         self.closedSet = self.create_closedSet() if goal != None and start != None else None
         self.openSet = self.create_openSet() if goal != None and start != None else None
         self.cameFrom = self.create_cameFrom() if goal != None and start != None else None
@@ -162,6 +170,13 @@ class PathPlanner():
             raise(ValueError, "Must create goal node before running search. Try running PathPlanner.set_goal(start_node)")
         if self.start == None:
             raise(ValueError, "Must create start node before running search. Try running PathPlanner.set_start(start_node)")
+        if self.landmarks is not None:
+            # Bounds of an older version of the map may overestimate the distances, the path would not be the shortest
+            self.landmarks.check_current(self.map)
+        if self.mode == "bidirectional":
+            return self.run_bidirectional_search()
+        if self.mode != "unidirectional":
+            raise ValueError("Unknown search mode: {}".format(self.mode))
 
         self.closedSet = self.closedSet if self.closedSet != None else self.create_closedSet()
         self.openSet = self.openSet if self.openSet != None else  self.create_openSet()
@@ -169,6 +184,7 @@ class PathPlanner():
         self.gScore = self.gScore if self.gScore != None else  self.create_gScore()
         self.fScore = self.fScore if self.fScore != None else  self.create_fScore()
 
+        self.expanded = 0
         while not self.is_open_empty():
             current = self.get_current_node()
 
@@ -178,8 +194,9 @@ class PathPlanner():
             else:
                 self.openSet.remove(current)
                 self.closedSet.add(current)
+                self.expanded += 1
 
-            for neighbor in self.get_neighbors(current):
+            for neighbor, cost in self.get_neighbor_costs(current):
                 if neighbor in self.closedSet:
                     continue    # Ignore the neighbor which is already evaluated.
 
@@ -188,11 +205,12 @@ class PathPlanner():
                 
                 # The distance from start to a neighbor
                 #the "dist_between" function may vary as per the solution requirements.
-                if self.get_tentative_gScore(current, neighbor) >= self.get_gScore(neighbor):
+                tentative_gScore = self.get_tentative_gScore(current, neighbor, cost)
+                if tentative_gScore >= self.get_gScore(neighbor):
                     continue        # This is not a better path.
 
                 # This path is the best until now. Record it!
-                self.record_best_path_to(current, neighbor)
+                self.record_best_path_to(current, neighbor, tentative_gScore)
         print("No Path Found")
         self.path = None
         return False
@@ -215,6 +233,62 @@ def create_closedSet(self):
     return set()
 
 
+# The open set is looked up for its lowest `fScore` node on every iteration, so instead of a plain `set` it is a binary heap (`heapq`) of `(fScore, order, node)` entries next to a set of its members. When the `fScore` of a node improves, a new entry is pushed (lazy decrease-key) and old entries of that node are skipped when they reach the top of the heap. Getting the current node is then O(log n) instead of a scan over the whole open set.
+
+# In[ ]:
+
+
+class OpenSet():
+    """Open set of nodes backed by a binary heap with lazy decrease-key"""
+    def __init__(self, nodes=()):
+        self._members = set()
+        self._heap = []
+        # Insertion order breaks ties between equal priorities
+        self._order = itertools.count()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, node):
+        return node in self._members
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def add(self, node, priority=math.inf):
+        """Adds a node, its priority can be given later with push"""
+        self.push(node, priority)
+
+    def push(self, node, priority):
+        """Adds a node or lowers its priority, the older entries of the node become stale"""
+        self._members.add(node)
+        heapq.heappush(self._heap, (priority, next(self._order), node))
+
+    def remove(self, node):
+        """Removes a node, its entries are dropped when they reach the top of the heap"""
+        self._members.remove(node)
+        heap = self._heap
+        while heap and heap[0][2] not in self._members:
+            heapq.heappop(heap)
+
+    def peek(self, priority_of):
+        """Returns the node with the lowest priority, priority_of gives the current priority of a node"""
+        heap = self._heap
+        while heap:
+            priority, _, node = heap[0]
+            if node not in self._members:
+                heapq.heappop(heap)
+                continue
+            current = priority_of(node)
+            if priority == current:
+                return node
+            # Stale priority, put the node back with its current one
+            heapq.heapreplace(heap, (current, next(self._order), node))
+        raise KeyError("peek from an empty open set")
+
+
 # In[10]:
 
 
@@ -225,7 +299,7 @@ def create_openSet(self):
         # TODO: return a data structure suitable to hold the set of currently discovered nodes 
         # that are not evaluated yet. Make sure to include the start node.
 
-        return set([self.start])
+        return OpenSet([self.start])
     
     raise(ValueError, "Must create start node before creating an open set. Try running PathPlanner.set_start(start_node)")
 
@@ -251,17 +325,10 @@ def create_gScore(self):
     # TODO:  return a data structure that holds the cost of getting from the start node to that node, for each node.
     # for each node. The cost of going from start to start is zero. The rest of the node's values should 
     # be set to infinity.
-    dic = {}
-     
-    cur_map = self.map
-    
-    for keys in cur_map.intersections:
-        
-        dic[keys] = math.inf
-
-    dic[self.start] = 0
     
-    return dic
+    # Only the nodes reached by the search get an entry, the missing ones are at infinity (see get_gScore),
+    # so starting a search does not depend on the size of the map
+    return {self.start: 0}
     
 
 
@@ -277,16 +344,8 @@ def create_fScore(self):
     # For the first node, that value is completely heuristic. The rest of the node's value should be 
     # set to infinity.
     
-    dic = {}
-    cur_map = self.map
-    
-    for keys in cur_map.intersections:
-        
-        dic[keys] = math.inf
-
-    dic[self.start] = self.heuristic_cost_estimate(self.start)
-            
-    return dic
+    # Like gScore, only the nodes reached by the search get an entry
+    return {self.start: self.heuristic_cost_estimate(self.start)}
     
     
 
@@ -358,8 +417,8 @@ def get_current_node(self):
     """ Returns the node in the open set with the lowest value of f(node)."""
     # TODO: Return the node in the open set with the lowest value of f(node).
     
-    #Extracting the values of nodes in openset from fscore 
-    return min(self.openSet,key=self.fScore.get)
+    #Top of the open set heap, skipping the stale entries 
+    return self.openSet.peek(self.fScore.get)
     
 
 
@@ -373,6 +432,18 @@ def get_neighbors(self, node):
     return curr_map.roads[node]
 
 
+# A `CSRGraph` (see `Map.to_csr`) already holds the length of every road, so on that representation the neighbors come with their precomputed costs instead of recomputing the distance.
+
+# In[ ]:
+
+
+def get_neighbor_costs(self, node):
+    """Returns (neighbor, distance to the neighbor) pairs of a node"""
+    if isinstance(self.map, CSRGraph):
+        return self.map.neighbor_costs(node)
+    return ((neighbor, self.distance(node, neighbor)) for neighbor in self.get_neighbors(node))
+
+
 # ### Scores and Costs
 # 
 # Below, you'll get into the main part of the calculation for determining the best path - calculating the various parts of the `fScore`.
@@ -383,7 +454,8 @@ def get_neighbors(self, node):
 def get_gScore(self, node):
     """Returns the g Score of a node"""
     # TODO: Return the g Score of a node
-    return self.gScore[node]
+    # Nodes not reached yet have no entry, their g Score is infinity
+    return self.gScore.get(node, math.inf)
 
 
 # In[21]:
@@ -403,23 +475,30 @@ def distance(self, node_1, node_2):
 # In[22]:
 
 
-def get_tentative_gScore(self, current, neighbor):
+def get_tentative_gScore(self, current, neighbor, dist=None):
     """Returns the tentative g Score of a node"""
     # TODO: Return the g Score of the current node 
     # plus distance from the current node to it's neighbors
     
     gScore = self.gScore[current]
-    dist = self.distance (current,neighbor)
+    if dist is None:
+        dist = self.distance (current,neighbor)
     return gScore+dist
 
 
+# The straight line distance is a weak estimate on sparse road networks. Given precomputed `landmarks` (see `landmarks.py`), the planner also uses the landmark (ALT) lower bound and keeps the larger of the two, which is still admissible.
+
 # In[23]:
 
 
 def heuristic_cost_estimate(self, node):
     """ Returns the heuristic cost estimate of a node """
     # TODO: Return the heuristic cost estimate of a node
-    return self.distance(node,self.goal)
+    estimate = self.distance(node,self.goal)
+    if self.landmarks is not None:
+        # Both are lower bounds of the road distance, the larger one is the closer
+        estimate = max(estimate, self.landmarks.estimate(node, self.goal))
+    return estimate
 
 
 # In[24]:
@@ -439,15 +518,96 @@ def calculate_fscore(self, node):
 # In[25]:
 
 
-def record_best_path_to(self, current, neighbor):
+def record_best_path_to(self, current, neighbor, tentative_gScore=None):
     """Record the best path to a node """
     # TODO: Record the best path to a node, by updating cameFrom, gScore, and fScore
+    if tentative_gScore is None:
+        tentative_gScore = self.get_tentative_gScore(current, neighbor)
     self.cameFrom[neighbor] = current
-    self.gScore[neighbor] = self.get_tentative_gScore(current, neighbor)
+    self.gScore[neighbor] = tentative_gScore
     self.fScore[neighbor] = self.calculate_fscore(neighbor)
+    self.openSet.push(neighbor, self.fScore[neighbor])
     
 
 
+# ### Bidirectional search
+# 
+# With `mode="bidirectional"` the planner runs one A\* search forward from the start and one backward from the goal, always expanding the side with the smaller open set, and stops once no node left in the open sets can improve the best meeting point found so far. Both searches need potentials that agree with each other, so they use the average of the two straight line distances: the forward search orders its nodes by `g + (d(node, goal) - d(node, start)) / 2` and the backward one by `g + (d(node, start) - d(node, goal)) / 2`. These are still consistent, so the path found is a shortest one. They are only half as sharp as the straight line distance to the goal though: the two searches pay off when the straight line is a poor estimate of the road distance (detours, dead ends), on grid-like maps where it is already close they expand about as many nodes as the forward search. `expanded` counts the nodes taken out of the open sets by either search, to compare the two modes.
+# 
+# The mode is opt-in: on the maps measured so far it expands more nodes than the default forward search, with the same path costs. Over all 1600 start and goal pairs of map_40 the forward search expands 8814 nodes and the bidirectional one 10490. On the jittered grids of `benchmark_bidirectional` (20 random queries) it expands 1020 nodes per query against 995 at 10k nodes, and 10009 against 9648 at 100k nodes. Run `benchmark_bidirectional(PathPlanner)` to measure it on other maps.
+
+# In[ ]:
+
+
+def run_bidirectional_search(self):
+    """Bidirectional A* between start and goal, returns the path (None if there is none)
+    Measured against the forward search, in expanded nodes: 10490 vs 8814 over all the map_40 pairs,
+    1020 vs 995 per query on the 10k node grid and 10009 vs 9648 on the 100k node grid"""
+    start, goal = self.start, self.goal
+
+    def potential(node):
+        # Potential of the forward search, the backward search uses the opposite
+        return (self.heuristic_cost_estimate(node) - self.distance(node, start)) / 2
+
+    # Index 0 is the forward search (from start), index 1 the backward one (from goal)
+    gScores = ({start: 0}, {goal: 0})
+    keys = ({start: potential(start)}, {goal: -potential(goal)})
+    cameFroms = ({}, {})
+    closedSets = (set(), set())
+    openSets = (OpenSet(), OpenSet())
+    openSets[0].push(start, keys[0][start])
+    openSets[1].push(goal, keys[1][goal])
+
+    best, meeting = (0, start) if start == goal else (math.inf, None)
+    self.expanded = 0
+    while openSets[0] and openSets[1]:
+        tops = (openSets[0].peek(keys[0].get), openSets[1].peek(keys[1].get))
+        # The keys of the two sides add up to the length of a path, none can be shorter than best anymore
+        if keys[0][tops[0]] + keys[1][tops[1]] >= best:
+            break
+
+        side = 0 if len(openSets[0]) <= len(openSets[1]) else 1
+        sign = 1 if side == 0 else -1
+        gScore, other_gScore = gScores[side], gScores[1 - side]
+        current = tops[side]
+        openSets[side].remove(current)
+        closedSets[side].add(current)
+        self.expanded += 1
+
+        for neighbor, cost in self.get_neighbor_costs(current):
+            if neighbor in closedSets[side]:
+                continue
+            tentative_gScore = gScore[current] + cost
+            if tentative_gScore >= gScore.get(neighbor, math.inf):
+                continue
+            gScore[neighbor] = tentative_gScore
+            cameFroms[side][neighbor] = current
+            keys[side][neighbor] = tentative_gScore + sign * potential(neighbor)
+            openSets[side].push(neighbor, keys[side][neighbor])
+            if neighbor in other_gScore and tentative_gScore + other_gScore[neighbor] < best:
+                best, meeting = tentative_gScore + other_gScore[neighbor], neighbor
+
+    self.gScore, self.fScore, self.cameFrom = gScores[0], keys[0], cameFroms[0]
+    self.openSet, self.closedSet = openSets[0], closedSets[0]
+    if meeting is None:
+        print("No Path Found")
+        self.path = None
+        return False
+
+    path = [meeting]
+    while path[-1] in cameFroms[0]:
+        path.append(cameFroms[0][path[-1]])
+    path.reverse()
+    node = meeting
+    while node in cameFroms[1]:
+        node = cameFroms[1][node]
+        # Like the forward search, the g Score of the path nodes is their distance from start
+        self.gScore[node] = best - gScores[1][node]
+        path.append(node)
+    self.path = path
+    return self.path
+
+
 # ### Associating your functions with the `PathPlanner` class
 # 
 # To check your implementations, we want to associate all of the above functions back to the `PathPlanner` class. Python makes this easy using the dot notation (i.e. `PathPlanner.myFunction`), and setting them equal to your function implementations. Run the below code cell for this to occur.
@@ -469,12 +629,14 @@ PathPlanner.set_goal = set_goal
 PathPlanner.is_open_empty = is_open_empty
 PathPlanner.get_current_node = get_current_node
 PathPlanner.get_neighbors = get_neighbors
+PathPlanner.get_neighbor_costs = get_neighbor_costs
 PathPlanner.get_gScore = get_gScore
 PathPlanner.distance = distance
 PathPlanner.get_tentative_gScore = get_tentative_gScore
 PathPlanner.heuristic_cost_estimate = heuristic_cost_estimate
 PathPlanner.calculate_fscore = calculate_fscore
 PathPlanner.record_best_path_to = record_best_path_to
+PathPlanner.run_bidirectional_search = run_bidirectional_search
 
 
 # ### Preliminary Test
@@ -522,9 +684,10 @@ show_map(map_40, start=start, goal=goal, path=PathPlanner(map_40, start, goal).p
 # In[29]:
 
 
-from test import test
+from test import test, test_extensions
 
 test(PathPlanner)
+test_extensions(PathPlanner)
 
 
 # ## Questions
@@ -0,0 +1,55 @@
+"""Batch route queries on a pool of worker processes.
+
+The map is handed to the workers once, when the pool starts, instead of being pickled with
+every query: on platforms with fork the workers inherit it from the parent process, elsewhere
+it is sent once to each worker by the pool initializer. Like test.py, the planner class is an
+argument, e.g. from the notebook:
+
+    from batch_planner import plan_many
+    paths = plan_many(PathPlanner, map_40.to_csr(), [(5, 34), (8, 24)], workers=4)
+
+A CSRGraph (Map.to_csr) is the better map to share: its numpy arrays stay shared between the
+forked workers, while the reference counting of the dicts and lists of a Map makes each worker
+copy the pages it touches.
+"""
+import multiprocessing
+
+# (planner_class, M) used by the queries of a worker process
+_shared = None
+
+
+def _init_worker(planner_class=None, M=None):
+    """Pool initializer, the forked workers already hold _shared"""
+    global _shared
+    if planner_class is not None:
+        _shared = (planner_class, M)
+
+
+def _plan(pair):
+    planner_class, M = _shared
+    start, goal = pair
+    return planner_class(M, start, goal).path
+
+
+def plan_many(planner_class, M, pairs, workers=None, chunksize=None):
+    """Returns the paths of a list of (start, goal) pairs on M, in the order of pairs.
+    workers is the number of processes (default: all cores), workers=1 plans in this process."""
+    global _shared
+    pairs = list(pairs)
+    if workers == 1 or len(pairs) < 2:
+        return [planner_class(M, start, goal).path for start, goal in pairs]
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        # Set before the workers are forked so they inherit it, nothing is pickled
+        _shared = (planner_class, M)
+        initargs = ()
+    else:
+        context = multiprocessing.get_context()
+        initargs = (planner_class, M)
+
+    try:
+        with context.Pool(workers, _init_worker, initargs) as pool:
+            return pool.map(_plan, pairs, chunksize)
+    finally:
+        _shared = None
@@ -0,0 +1,387 @@
+"""Benchmarks of the route planner on synthetic road maps.
+
+Like test.py, the functions take the PathPlanner class as an argument, e.g. from the notebook:
+
+    from benchmark import benchmark_open_set
+    benchmark_open_set(PathPlanner)
+"""
+import math
+import os
+import multiprocessing
+import random
+import tempfile
+import time
+import tracemalloc
+
+from batch_planner import plan_many
+from contraction import ContractionHierarchy
+from helpers import CSRGraph, Map, distance_matrix, load_map_graph, shortest_path_tree
+from landmarks import Landmarks
+from route_cache import RouteCache
+from spatial_index import GridIndex
+
+SIZES = (10000, 100000, 1000000)
+
+
+def synthetic_map_dict(n_nodes, seed=0, jitter=0.3, diagonals=0.1):
+    """Returns a map dict (same format as map_40_dict) of a jittered grid road network"""
+    rand = random.Random(seed)
+    side = int(math.ceil(math.sqrt(n_nodes)))
+    map_dict = {}
+    for node in range(n_nodes):
+        row, col = divmod(node, side)
+        pos = ((col + jitter * rand.uniform(-1, 1)) / side, (row + jitter * rand.uniform(-1, 1)) / side)
+        connections = []
+        if col + 1 < side and node + 1 < n_nodes:
+            connections.append(node + 1)
+        if node + side < n_nodes:
+            connections.append(node + side)
+        if col + 1 < side and node + side + 1 < n_nodes and rand.random() < diagonals:
+            connections.append(node + side + 1)
+        map_dict[node] = {'pos': pos, 'connections': connections}
+    return map_dict
+
+
+def synthetic_map(n_nodes, seed=0):
+    """Returns a Map of a jittered grid road network with n_nodes intersections"""
+    return Map(load_map_graph(synthetic_map_dict(n_nodes, seed)))
+
+
+def linear_scan_planner(planner_class):
+    """Returns a planner class using the previous open set (a set scanned with min on every iteration)"""
+    class LinearScanPlanner(planner_class):
+        def create_openSet(self):
+            return set([self.start])
+
+        def get_current_node(self):
+            return min(self.openSet, key=self.fScore.get)
+
+        def record_best_path_to(self, current, neighbor, tentative_gScore=None):
+            self.cameFrom[neighbor] = current
+            self.gScore[neighbor] = self.get_tentative_gScore(current, neighbor) if tentative_gScore is None else tentative_gScore
+            self.fScore[neighbor] = self.calculate_fscore(neighbor)
+
+    return LinearScanPlanner
+
+
+def time_planner(planner_class, M, start, goal):
+    """Returns (seconds, path) of one search"""
+    begin = time.perf_counter()
+    path = planner_class(M, start, goal).path
+    return time.perf_counter() - begin, path
+
+
+def benchmark_open_set(planner_class, sizes=SIZES, baseline_max_nodes=100000, seed=0):
+    """Times a corner to corner search with the heap open set against the linear scan one.
+    The linear scan is quadratic, it is only run on maps up to baseline_max_nodes."""
+    baseline_class = linear_scan_planner(planner_class)
+    print("{:>10} {:>12} {:>14} {:>10}".format("nodes", "heap (s)", "linear (s)", "speedup"))
+    results = []
+    for n_nodes in sizes:
+        M = synthetic_map(n_nodes, seed)
+        start, goal = 0, n_nodes - 1
+        heap_time, path = time_planner(planner_class, M, start, goal)
+        linear_time = None
+        if n_nodes <= baseline_max_nodes:
+            linear_time, linear_path = time_planner(baseline_class, M, start, goal)
+            assert linear_path == path, "The heap open set changed the path"
+        results.append((n_nodes, heap_time, linear_time))
+        if linear_time is None:
+            print("{:>10} {:>12.3f} {:>14} {:>10}".format(n_nodes, heap_time, "-", "-"))
+        else:
+            print("{:>10} {:>12.3f} {:>14.3f} {:>9.1f}x".format(n_nodes, heap_time, linear_time, linear_time / heap_time))
+    return results
+
+
+def benchmark_csr(planner_class, sizes=SIZES, seed=0, queries=20):
+    """Compares the memory per road and the search time of a Map against its CSRGraph"""
+    print("{:>10} {:>16} {:>16} {:>12} {:>12}".format("nodes", "Map (B/road)", "CSR (B/road)", "Map (s)", "CSR (s)"))
+    results = []
+    for n_nodes in sizes:
+        map_dict = synthetic_map_dict(n_nodes, seed)
+        tracemalloc.start()
+        M = Map(load_map_graph(map_dict))
+        map_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        csr = M.to_csr()
+        n_roads = len(csr.neighbors) // 2
+
+        rand = random.Random(seed)
+        pairs = [(rand.randrange(n_nodes), rand.randrange(n_nodes)) for i in range(queries)]
+        map_time = sum(time_planner(planner_class, M, start, goal)[0] for start, goal in pairs)
+        csr_time = sum(time_planner(planner_class, csr, start, goal)[0] for start, goal in pairs)
+
+        results.append((n_nodes, map_bytes / n_roads, csr.nbytes() / n_roads, map_time, csr_time))
+        print("{:>10} {:>16.1f} {:>16.1f} {:>12.3f} {:>12.3f}".format(*results[-1]))
+    return results
+
+
+def eager_state_planner(planner_class):
+    """Returns a planner class building the previous gScore / fScore dicts with an entry for every intersection"""
+    class EagerStatePlanner(planner_class):
+        def create_gScore(self):
+            scores = dict.fromkeys(self.map.intersections, math.inf)
+            scores[self.start] = 0
+            return scores
+
+        def create_fScore(self):
+            scores = dict.fromkeys(self.map.intersections, math.inf)
+            scores[self.start] = self.heuristic_cost_estimate(self.start)
+            return scores
+
+    return EagerStatePlanner
+
+
+def benchmark_local_queries(planner_class, sizes=SIZES, seed=0, queries=100, hops=5):
+    """Times short queries (goal a few roads away from the start) with the lazy search state
+    against the full map gScore / fScore dicts. The lazy one should not depend on the map size."""
+    eager_class = eager_state_planner(planner_class)
+    print("{:>10} {:>16} {:>16} {:>10}".format("nodes", "lazy (ms/query)", "eager (ms/query)", "speedup"))
+    results = []
+    for n_nodes in sizes:
+        M = synthetic_map(n_nodes, seed)
+        rand = random.Random(seed)
+        pairs = []
+        for i in range(queries):
+            start = goal = rand.randrange(n_nodes)
+            for hop in range(hops):
+                goal = rand.choice(M.roads[goal] or [goal])
+            pairs.append((start, goal))
+
+        lazy_time = sum(time_planner(planner_class, M, start, goal)[0] for start, goal in pairs) / queries
+        eager_time = sum(time_planner(eager_class, M, start, goal)[0] for start, goal in pairs) / queries
+        results.append((n_nodes, lazy_time, eager_time))
+        print("{:>10} {:>16.3f} {:>16.3f} {:>9.1f}x".format(n_nodes, lazy_time * 1e3, eager_time * 1e3, eager_time / lazy_time))
+    return results
+
+
+def benchmark_plan_many(planner_class, n_nodes=100000, queries=2000, workers=None, seed=0):
+    """Throughput (queries per second) of plan_many on a CSRGraph against the number of worker processes"""
+    if workers is None:
+        workers = sorted(set([1, 2, 4, multiprocessing.cpu_count()]))
+    csr = synthetic_map(n_nodes, seed).to_csr()
+    rand = random.Random(seed)
+    pairs = [(rand.randrange(n_nodes), rand.randrange(n_nodes)) for i in range(queries)]
+
+    print("{:>8} {:>12} {:>12} {:>10}".format("workers", "time (s)", "queries/s", "speedup"))
+    results = []
+    reference = None
+    for n_workers in workers:
+        begin = time.perf_counter()
+        paths = plan_many(planner_class, csr, pairs, workers=n_workers)
+        elapsed = time.perf_counter() - begin
+        if reference is None:
+            reference = (elapsed, paths)
+        assert paths == reference[1], "The paths depend on the number of workers"
+        results.append((n_workers, elapsed, queries / elapsed))
+        print("{:>8} {:>12.3f} {:>12.1f} {:>9.2f}x".format(n_workers, elapsed, queries / elapsed, reference[0] / elapsed))
+    return results
+
+
+def benchmark_route_cache(planner_class, n_nodes=20000, queries=2000, distinct=200, maxsize=128, seed=0):
+    """Times a stream of repeated queries (a few popular routes, drawn with weights 1/rank)
+    without a cache, with the RouteCache and with the RouteCache reusing subpaths"""
+    csr = synthetic_map(n_nodes, seed).to_csr()
+    rand = random.Random(seed)
+    routes = [(rand.randrange(n_nodes), rand.randrange(n_nodes)) for i in range(distinct)]
+    stream = rand.choices(routes, weights=[1 / rank for rank in range(1, distinct + 1)], k=queries)
+
+    begin = time.perf_counter()
+    for start, goal in stream:
+        planner_class(csr, start, goal)
+    uncached_time = time.perf_counter() - begin
+
+    print("{:>16} {:>10} {:>8} {:>8} {:>8} {:>10}".format("", "time (s)", "hits", "subpath", "misses", "speedup"))
+    print("{:>16} {:>10.3f} {:>8} {:>8} {:>8} {:>10}".format("no cache", uncached_time, "-", "-", queries, "-"))
+    results = [("no cache", uncached_time, None)]
+    for name, reuse_subpaths in (("cache", False), ("cache+subpaths", True)):
+        cache = RouteCache(planner_class, csr, maxsize=maxsize, reuse_subpaths=reuse_subpaths)
+        begin = time.perf_counter()
+        for start, goal in stream:
+            cache.get(start, goal)
+        elapsed = time.perf_counter() - begin
+        info = cache.cache_info()
+        results.append((name, elapsed, info))
+        print("{:>16} {:>10.3f} {:>8} {:>8} {:>8} {:>9.1f}x".format(
+            name, elapsed, info.hits, info.subpath_hits, info.misses, uncached_time / elapsed))
+    return results
+
+
+def path_cost(M, path):
+    """Length of a path on a Map or a CSRGraph"""
+    positions = [M.intersections[node] for node in path]
+    return sum(math.hypot(x2 - x1, y2 - y1) for (x1, y1), (x2, y2) in zip(positions, positions[1:]))
+
+
+def benchmark_bidirectional(planner_class, sizes=SIZES, seed=0, queries=20):
+    """Compares the expanded nodes and the search time of the unidirectional and bidirectional modes"""
+    print("{:>10} {:>14} {:>14} {:>12} {:>12}".format("nodes", "uni expanded", "bi expanded", "uni (s)", "bi (s)"))
+    results = []
+    for n_nodes in sizes:
+        csr = synthetic_map(n_nodes, seed).to_csr()
+        rand = random.Random(seed)
+        pairs = [(rand.randrange(n_nodes), rand.randrange(n_nodes)) for i in range(queries)]
+        totals = {}
+        for mode in ("unidirectional", "bidirectional"):
+            expanded, elapsed, costs = 0, 0.0, []
+            for start, goal in pairs:
+                begin = time.perf_counter()
+                planner = planner_class(csr, start, goal, mode=mode)
+                elapsed += time.perf_counter() - begin
+                expanded += planner.expanded
+                costs.append(path_cost(csr, planner.path))
+            totals[mode] = (expanded / queries, elapsed, costs)
+        for uni_cost, bi_cost in zip(totals["unidirectional"][2], totals["bidirectional"][2]):
+            assert math.isclose(uni_cost, bi_cost, rel_tol=1e-9), "The bidirectional path is longer"
+        results.append((n_nodes,) + totals["unidirectional"][:2] + totals["bidirectional"][:2])
+        print("{:>10} {:>14.0f} {:>14.0f} {:>12.3f} {:>12.3f}".format(
+            n_nodes, totals["unidirectional"][0], totals["bidirectional"][0], totals["unidirectional"][1], totals["bidirectional"][1]))
+    return results
+
+
+def benchmark_landmarks(planner_class, sizes=SIZES, k=16, seed=0, queries=20):
+    """Compares the expanded nodes and search time with the straight line heuristic and with ALT landmarks"""
+    print("{:>10} {:>12} {:>14} {:>14} {:>12} {:>12}".format(
+        "nodes", "build (s)", "A* expanded", "ALT expanded", "A* (s)", "ALT (s)"))
+    results = []
+    for n_nodes in sizes:
+        csr = synthetic_map(n_nodes, seed).to_csr()
+        begin = time.perf_counter()
+        landmarks = Landmarks.build(csr, k, seed)
+        build_time = time.perf_counter() - begin
+
+        rand = random.Random(seed)
+        pairs = [(rand.randrange(n_nodes), rand.randrange(n_nodes)) for i in range(queries)]
+        totals = {}
+        for name, table in (("A*", None), ("ALT", landmarks)):
+            expanded, elapsed, costs = 0, 0.0, []
+            for start, goal in pairs:
+                begin = time.perf_counter()
+                planner = planner_class(csr, start, goal, landmarks=table)
+                elapsed += time.perf_counter() - begin
+                expanded += planner.expanded
+                costs.append(path_cost(csr, planner.path))
+            totals[name] = (expanded / queries, elapsed, costs)
+        for cost, alt_cost in zip(totals["A*"][2], totals["ALT"][2]):
+            assert math.isclose(cost, alt_cost, rel_tol=1e-9), "The ALT path is longer"
+        results.append((n_nodes, build_time, totals["A*"][0], totals["ALT"][0], totals["A*"][1], totals["ALT"][1]))
+        print("{:>10} {:>12.3f} {:>14.0f} {:>14.0f} {:>12.3f} {:>12.3f}".format(*results[-1]))
+    return results
+
+
+def benchmark_contraction(planner_class, sizes=(1000, 10000), seed=0, queries=100):
+    """Contraction hierarchy build time, shortcuts and query time against PathPlanner.
+    The contraction runs in pure Python, it takes minutes from about 100000 intersections."""
+    print("{:>10} {:>12} {:>16} {:>14} {:>14}".format("nodes", "build (s)", "shortcuts/node", "A* (ms/query)", "CH (ms/query)"))
+    results = []
+    for n_nodes in sizes:
+        csr = synthetic_map(n_nodes, seed).to_csr()
+        begin = time.perf_counter()
+        hierarchy = ContractionHierarchy.build(csr)
+        build_time = time.perf_counter() - begin
+
+        rand = random.Random(seed)
+        pairs = [(rand.randrange(n_nodes), rand.randrange(n_nodes)) for i in range(queries)]
+        begin = time.perf_counter()
+        routes = [hierarchy.query(start, goal) for start, goal in pairs]
+        ch_time = (time.perf_counter() - begin) / queries
+        planner_time = 0.0
+        for (start, goal), (path, cost) in zip(pairs, routes):
+            elapsed, planner_path = time_planner(planner_class, csr, start, goal)
+            planner_time += elapsed / queries
+            assert math.isclose(cost, path_cost(csr, planner_path), rel_tol=1e-9), "The hierarchy path is longer"
+        results.append((n_nodes, build_time, hierarchy.shortcut_count() / n_nodes, planner_time, ch_time))
+        print("{:>10} {:>12.1f} {:>16.2f} {:>14.3f} {:>14.3f}".format(
+            n_nodes, build_time, hierarchy.shortcut_count() / n_nodes, planner_time * 1e3, ch_time * 1e3))
+    return results
+
+
+def benchmark_map_loading(sizes=SIZES, seed=0):
+    """Compares loading a map from a pickled networkx graph (Map.save) and from the binary map format
+    (Map.save_binary, CSRGraph.load), read into memory and memory mapped"""
+    print("{:>10} {:>14} {:>14} {:>14} {:>14} {:>14}".format(
+        "nodes", "pickle (MB)", "binary (MB)", "pickle (s)", "binary (s)", "mmap (s)"))
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_file, binary_file = os.path.join(directory, "map.pickle"), os.path.join(directory, "map.bin")
+        for n_nodes in sizes:
+            M = synthetic_map(n_nodes, seed)
+            M.save(pickle_file)
+            M.save_binary(binary_file)
+
+            times = []
+            loaders = (lambda: Map.load(pickle_file), lambda: CSRGraph.load(binary_file, mmap=False),
+                       lambda: CSRGraph.load(binary_file, mmap=True))
+            for load in loaders:
+                begin = time.perf_counter()
+                loaded = load()
+                len(loaded.roads[0])
+                times.append(time.perf_counter() - begin)
+            sizes_mb = [os.path.getsize(filename) / 1e6 for filename in (pickle_file, binary_file)]
+            results.append((n_nodes,) + tuple(sizes_mb) + tuple(times))
+            print("{:>10} {:>14.1f} {:>14.1f} {:>14.4f} {:>14.4f} {:>14.4f}".format(*results[-1]))
+    return results
+
+
+def linear_scan_nearest(M, x, y):
+    """Nearest intersection by a scan of all the intersections (the previous snapping)"""
+    return min(M.intersections, key=lambda node: math.hypot(M.intersections[node][0] - x, M.intersections[node][1] - y))
+
+
+def benchmark_spatial_index(sizes=SIZES, seed=0, queries=10000, scan_queries=20):
+    """Snapping random positions to their nearest intersection: linear scan, GridIndex.nearest and
+    GridIndex.nearest_batch. The scan is slow, it is timed on scan_queries positions only."""
+    print("{:>10} {:>12} {:>16} {:>16} {:>16}".format("nodes", "build (s)", "scan (us/query)", "grid (us/query)", "batch (us/query)"))
+    results = []
+    for n_nodes in sizes:
+        M = synthetic_map(n_nodes, seed)
+        begin = time.perf_counter()
+        index = GridIndex.from_map(M)
+        build_time = time.perf_counter() - begin
+
+        rand = random.Random(seed)
+        points = [(rand.random(), rand.random()) for i in range(queries)]
+        begin = time.perf_counter()
+        scanned = [linear_scan_nearest(M, x, y) for x, y in points[:scan_queries]]
+        scan_time = (time.perf_counter() - begin) / scan_queries
+        begin = time.perf_counter()
+        nearest = [index.nearest(x, y) for x, y in points]
+        grid_time = (time.perf_counter() - begin) / queries
+        begin = time.perf_counter()
+        batch = index.nearest_batch(points)[0]
+        batch_time = (time.perf_counter() - begin) / queries
+
+        assert nearest[:scan_queries] == scanned and batch.tolist() == nearest, "The index found another intersection"
+        results.append((n_nodes, build_time, scan_time, grid_time, batch_time))
+        print("{:>10} {:>12.3f} {:>16.1f} {:>16.2f} {:>16.2f}".format(n_nodes, build_time, scan_time * 1e6, grid_time * 1e6, batch_time * 1e6))
+    return results
+
+
+def benchmark_shortest_path_tree(planner_class, sizes=(1000, 10000, 100000), seed=0, sample_goals=20, depots=5, customers=50):
+    """One source to every intersection: shortest_path_tree against one PathPlanner search per goal (timed
+    on sample_goals goals and extrapolated), then a depots x customers distance_matrix"""
+    print("{:>10} {:>12} {:>16} {:>14}".format("nodes", "tree (s)", "planner (s, est)", "matrix (s)"))
+    results = []
+    for n_nodes in sizes:
+        csr = synthetic_map(n_nodes, seed).to_csr()
+        rand = random.Random(seed)
+        source = rand.randrange(n_nodes)
+        begin = time.perf_counter()
+        distances, predecessors = shortest_path_tree(csr, source)
+        tree_time = time.perf_counter() - begin
+
+        goals = [rand.randrange(n_nodes) for i in range(sample_goals)]
+        begin = time.perf_counter()
+        for goal in goals:
+            planner = planner_class(csr, source, goal)
+            assert math.isclose(planner.gScore[goal], distances[goal], rel_tol=1e-9), "The tree distance differs"
+        planner_time = (time.perf_counter() - begin) / sample_goals * n_nodes
+
+        sources = [rand.randrange(n_nodes) for i in range(depots)]
+        targets = [rand.randrange(n_nodes) for i in range(customers)]
+        begin = time.perf_counter()
+        distance_matrix(csr, sources, targets)
+        matrix_time = time.perf_counter() - begin
+        results.append((n_nodes, tree_time, planner_time, matrix_time))
+        print("{:>10} {:>12.3f} {:>16.1f} {:>14.3f}".format(*results[-1]))
+    return results
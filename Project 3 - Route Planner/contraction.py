@@ -0,0 +1,269 @@
+"""Contraction hierarchies for cross-map route queries.
+
+Preprocessing contracts the intersections one by one, least important first. Contracting an
+intersection removes it from the remaining map and adds a shortcut between two of its neighbors
+whenever the road through it is the only shortest path between them (no witness path is found).
+The rank of an intersection is its position in that order. A query is a bidirectional Dijkstra
+from start and goal which only follows roads and shortcuts towards higher ranks, so it settles a
+small part of the map, then the shortcuts of the path are unpacked back into intersections:
+
+    from contraction import ContractionHierarchy
+    hierarchy = ContractionHierarchy.build(map_40)
+    hierarchy.save('map_40_hierarchy.npz')
+    path, cost = hierarchy.query(5, 34)    # same path as PathPlanner(map_40, 5, 34).path
+
+Once the map it was built from changes, the hierarchy raises ValueError instead of answering with
+routes of the older map. A loaded hierarchy is only checked against the map given to load.
+
+Only the upward roads are stored, as CSR arrays like CSRGraph: the roads from the intersection at
+index i to higher ranked ones are up_targets[up_offsets[i]:up_offsets[i + 1]], with their length
+in up_weights and, for a shortcut, the index of the contracted intersection in up_middles (-1 for
+a road of the map). Roads go both ways, so the same arrays serve both directions of the query.
+"""
+import heapq
+import math
+
+import numpy as np
+
+from helpers import NodeIndex, as_csr
+
+
+class ContractionHierarchy(NodeIndex):
+    """Upward roads and shortcuts of a contracted map"""
+    def __init__(self, rank, up_offsets, up_targets, up_weights, up_middles, node_ids=None, version=0):
+        NodeIndex.__init__(self, node_ids, version)
+        self.rank = rank
+        self.up_offsets = up_offsets
+        self.up_targets = up_targets
+        self.up_weights = up_weights
+        self.up_middles = up_middles
+        # Python lists of the arrays for the query loop, as in CSRGraph._adjacency_lists
+        self._lists = None
+
+    @classmethod
+    def build(cls, M, witness_settled=64):
+        """Contracts M (a Map or a CSRGraph). witness_settled bounds the witness searches: a search
+        giving up early only adds a shortcut that was not needed, the queries stay exact."""
+        csr = as_csr(M)
+        n = len(csr)
+        offsets, neighbors, weights = csr.offsets.tolist(), csr.neighbors.tolist(), csr.weights.tolist()
+
+        # Roads between the intersections not contracted yet, index -> {neighbor index: length}
+        adjacency = [{} for i in range(n)]
+        for i in range(n):
+            roads = adjacency[i]
+            for k in range(offsets[i], offsets[i + 1]):
+                j = neighbors[k]
+                if j != i and weights[k] < roads.get(j, math.inf):
+                    roads[j] = weights[k]
+        # (lower index, higher index) -> contracted intersection of a shortcut
+        middles = {}
+        contracted_neighbors = [0] * n
+        # Depth of the hierarchy below each intersection
+        levels = [0] * n
+
+        def priority(i):
+            # Edge difference, plus the contracted neighbors and the depth which spread the contraction
+            # evenly over the map. Returns the shortcuts too, they are added if i is contracted now
+            shortcuts = _shortcuts(adjacency, i, witness_settled)
+            return 2 * (len(shortcuts) - len(adjacency[i])) + contracted_neighbors[i] + levels[i], shortcuts
+
+        heap = [(priority(i)[0], i) for i in range(n)]
+        heapq.heapify(heap)
+        rank = np.empty(n, dtype=np.int32)
+        up = [None] * n
+        order = 0
+        while heap:
+            _, i = heapq.heappop(heap)
+            # Lazy update: the priority may have changed since it was pushed
+            current, shortcuts = priority(i)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, i))
+                continue
+
+            for u, x, length in shortcuts:
+                if length < adjacency[u].get(x, math.inf):
+                    adjacency[u][x] = adjacency[x][u] = length
+                    middles[(u, x) if u < x else (x, u)] = i
+
+            roads = adjacency[i]
+            up[i] = [(j, length, middles.get((i, j) if i < j else (j, i), -1)) for j, length in roads.items()]
+            for j in roads:
+                del adjacency[j][i]
+                contracted_neighbors[j] += 1
+                levels[j] = max(levels[j], levels[i] + 1)
+            adjacency[i] = None
+            rank[i] = order
+            order += 1
+
+        degrees = np.fromiter((len(roads) for roads in up), dtype=np.int64, count=n)
+        up_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(degrees, out=up_offsets[1:])
+        flat = [road for roads in up for road in roads]
+        up_targets = np.array([road[0] for road in flat], dtype=np.int32)
+        up_weights = np.array([road[1] for road in flat], dtype=np.float64)
+        up_middles = np.array([road[2] for road in flat], dtype=np.int32)
+        hierarchy = cls(rank, up_offsets, up_targets, up_weights, up_middles, csr.node_ids, M.version)
+        hierarchy.map = M
+        return hierarchy
+
+    def __len__(self):
+        return len(self.rank)
+
+    def shortcut_count(self):
+        """Number of shortcuts added by the contraction"""
+        return int(np.count_nonzero(self.up_middles >= 0))
+
+    def query(self, start, goal):
+        """Returns (path, cost) of the shortest route from start to goal, (None, inf) when there is none.
+        Raises ValueError when the map changed since the hierarchy was built"""
+        self.check_map()
+        if start == goal:
+            return [start], 0.0
+        if self._lists is None:
+            self._lists = (self.up_offsets.tolist(), self.up_targets.tolist(), self.up_weights.tolist())
+        offsets, targets, weights = self._lists
+
+        s, t = self.index_of(start), self.index_of(goal)
+        # Index 0 is the search from start, index 1 the one from goal
+        distances = ({s: 0.0}, {t: 0.0})
+        # index -> (previous index, road index) of the upward road it was reached by
+        parents = ({s: None}, {t: None})
+        heaps = ([(0.0, s)], [(0.0, t)])
+        best, meeting = math.inf, None
+        while heaps[0] or heaps[1]:
+            # Settle the smallest distance of both sides, a side stops when it cannot improve best
+            side = 0 if heaps[0] and (not heaps[1] or heaps[0][0][0] <= heaps[1][0][0]) else 1
+            heap, distance, other = heaps[side], distances[side], distances[1 - side]
+            d, i = heapq.heappop(heap)
+            if d > distance[i]:
+                continue
+            if d >= best:
+                heap.clear()
+                continue
+            if i in other and d + other[i] < best:
+                best, meeting = d + other[i], i
+            road_range = range(offsets[i], offsets[i + 1])
+            # Stall on demand: a higher ranked neighbor already reached by a shorter way means i is not on
+            # a shortest path of this side, its roads do not need to be followed
+            if any(distance.get(targets[k], math.inf) + weights[k] < d for k in road_range):
+                continue
+            parent = parents[side]
+            for k in road_range:
+                j = targets[k]
+                candidate = d + weights[k]
+                if candidate < distance.get(j, math.inf):
+                    distance[j] = candidate
+                    parent[j] = (i, k)
+                    heapq.heappush(heap, (candidate, j))
+
+        if meeting is None:
+            return None, math.inf
+
+        # Upward roads start -> meeting, then meeting -> goal
+        roads = []
+        i = meeting
+        while parents[0][i] is not None:
+            j, k = parents[0][i]
+            roads.append((j, i, k))
+            i = j
+        roads.reverse()
+        i = meeting
+        while parents[1][i] is not None:
+            j, k = parents[1][i]
+            roads.append((i, j, k))
+            i = j
+
+        path = [s]
+        for a, b, k in roads:
+            self._unpack(a, b, k, path)
+        return [self.node_of(i) for i in path], best
+
+    def path(self, start, goal):
+        """Returns the shortest path from start to goal, None when there is none"""
+        return self.query(start, goal)[0]
+
+    def _road(self, i, j):
+        """Index of the upward road from i (the lower ranked one) to j"""
+        offsets, targets, _ = self._lists
+        return offsets[i] + targets[offsets[i]:offsets[i + 1]].index(j)
+
+    def _unpack(self, a, b, k, path):
+        """Appends to path the intersections after a along the road or shortcut k between a and b"""
+        middles = self.up_middles
+        stack = [(a, b, k)]
+        while stack:
+            a, b, k = stack.pop()
+            m = int(middles[k])
+            if m < 0:
+                path.append(b)
+                continue
+            # m was contracted before a and b, both halves are upward roads of m
+            stack.append((m, b, self._road(m, b)))
+            stack.append((a, m, self._road(m, a)))
+
+    def nbytes(self):
+        """Memory used by the arrays"""
+        arrays = [self.rank, self.up_offsets, self.up_targets, self.up_weights, self.up_middles]
+        if self.node_ids is not None:
+            arrays.append(self.node_ids)
+        return sum(array.nbytes for array in arrays)
+
+    def save(self, filename):
+        arrays = {'rank': self.rank, 'up_offsets': self.up_offsets, 'up_targets': self.up_targets,
+                  'up_weights': self.up_weights, 'up_middles': self.up_middles, 'version': self.version}
+        if self.node_ids is not None:
+            arrays['node_ids'] = self.node_ids
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename, M=None):
+        """Reads a hierarchy written by save. With M, the map it was built from, raises ValueError when
+        the file is of another version of M and refuses the queries once M changes, like a built one"""
+        with np.load(filename) as data:
+            node_ids = data['node_ids'] if 'node_ids' in data.files else None
+            hierarchy = cls(data['rank'], data['up_offsets'], data['up_targets'], data['up_weights'],
+                            data['up_middles'], node_ids, int(data['version']))
+        if M is not None:
+            hierarchy.check_current(M)
+            hierarchy.map = M
+        return hierarchy
+
+
+def _shortcuts(adjacency, i, witness_settled):
+    """Shortcuts (u, x, length) needed to contract i: pairs of neighbors whose shortest path goes through i"""
+    roads = adjacency[i]
+    neighbors = list(roads)
+    shortcuts = []
+    for n, u in enumerate(neighbors[:-1]):
+        targets = neighbors[n + 1:]
+        limit = roads[u] + max(roads[x] for x in targets)
+        witnesses = _witness_search(adjacency, u, i, set(targets), limit, witness_settled)
+        for x in targets:
+            length = roads[u] + roads[x]
+            if witnesses.get(x, math.inf) > length:
+                shortcuts.append((u, x, length))
+    return shortcuts
+
+
+def _witness_search(adjacency, source, skipped, targets, limit, max_settled):
+    """Distances from source found by a Dijkstra avoiding skipped, bounded by limit and max_settled"""
+    distances = {source: 0.0}
+    heap = [(0.0, source)]
+    settled = 0
+    while heap and targets and settled < max_settled:
+        d, u = heapq.heappop(heap)
+        if d > distances[u]:
+            continue
+        if d > limit:
+            break
+        settled += 1
+        targets.discard(u)
+        for v, length in adjacency[u].items():
+            if v == skipped:
+                continue
+            candidate = d + length
+            if candidate < distances.get(v, math.inf):
+                distances[v] = candidate
+                heapq.heappush(heap, (candidate, v))
+    return distances
@@ -1,12 +1,27 @@
 
+import heapq
+import itertools
+import math
 import networkx as nx
+import numpy as np
 import pickle
 import plotly.plotly as py
 import random
+import struct
 from plotly.graph_objs import *
 from plotly.offline import init_notebook_mode, plot, iplot
 init_notebook_mode(connected=True)
 
+# Binary map format (CSRGraph.save / CSRGraph.load): little endian header, then the arrays
+MAP_MAGIC = b'RMAP'
+MAP_FORMAT_VERSION = 1
+# magic, format version, flags, intersections, roads (each way), map version
+MAP_HEADER = struct.Struct('<4sIIqqq')
+MAP_ALIGNMENT = 64
+# Header flags
+MAP_NODE_IDS = 1
+MAP_INT64_OFFSETS = 2
+
 
 map_10_dict = {
 	0: {'pos': (0.7798606835438107, 0.6922727646627362), 'connections': [7, 6, 5]}, 
@@ -69,19 +84,369 @@ class Map:
 	def __init__(self, G):
 		self._graph = G
 		self.intersections = nx.get_node_attributes(G, "pos")
-		self.roads = [list(G[node]) for node in G.nodes()]
+		self.roads = _roads_of(G)
+		self._csr = None
+		# Incremented on every change of the intersections or roads, so caches can tell stale results
+		self.version = 0
 
 	def save(self, filename):
 		with open(filename, 'wb') as f:
 			pickle.dump(self._graph, f)
 
+	def save_binary(self, filename):
+		"""Writes the map in the binary map format (see CSRGraph.save), read back with CSRGraph.load"""
+		self.to_csr().save(filename)
+
+	@staticmethod
+	def load(filename):
+		"""Reads a map written by save. A file written by save_binary is read with CSRGraph.load instead"""
+		with open(filename, 'rb') as f:
+			if f.read(len(MAP_MAGIC)) == MAP_MAGIC:
+				raise ValueError("{} is a binary map file, read it with CSRGraph.load".format(filename))
+			f.seek(0)
+			return Map(pickle.load(f))
+
+	def add_intersection(self, node, pos):
+		"""Adds (or moves) an intersection"""
+		self._graph.add_node(node, pos=pos)
+		self._changed()
+
+	def remove_intersection(self, node):
+		"""Removes an intersection and its roads"""
+		self._graph.remove_node(node)
+		self._changed()
+
+	def add_road(self, node_1, node_2):
+		"""Adds a road between two intersections"""
+		self._graph.add_edge(node_1, node_2)
+		self._changed()
+
+	def remove_road(self, node_1, node_2):
+		"""Removes the road between two intersections"""
+		self._graph.remove_edge(node_1, node_2)
+		self._changed()
+
+	def _changed(self):
+		G = self._graph
+		self.intersections = nx.get_node_attributes(G, "pos")
+		self.roads = _roads_of(G)
+		self._csr = None
+		self.version += 1
+
+	def to_csr(self):
+		"""Returns the map as a CSRGraph (built once, then cached)"""
+		if self._csr is None:
+			nodes = list(self._graph.nodes())
+			self._csr = CSRGraph.from_adjacency(nodes, [self.intersections[node] for node in nodes],
+				[self._graph[node] for node in nodes])
+			self._csr.version = self.version
+		return self._csr
+
+
+def _roads_of(G):
+	"""Neighbor lists of the intersections, looked up by intersection ID: a list when the IDs are 0..N-1
+	in order (as in map_10 and map_40), a dict otherwise (e.g. once an intersection was removed)"""
+	if all(node == i for i, node in enumerate(G.nodes())):
+		return [list(G[node]) for node in G.nodes()]
+	return {node: list(G[node]) for node in G.nodes()}
+
+
+def as_csr(M):
+	"""CSRGraph of M, a Map (its cached to_csr) or a CSRGraph"""
+	return M if isinstance(M, CSRGraph) else M.to_csr()
+
+
+class NodeIndex:
+	"""Base of the arrays built from a map: CSRGraph and the precomputed tables (landmarks, contraction
+	hierarchy, grid index). They store the intersections by array index 0..N-1, node_ids[i] is the
+	intersection ID at index i (None when the IDs are 0..N-1, the index is then the ID itself).
+
+	The arrays are never updated. version is the Map.version they were built from: once the map changes
+	they describe an older map (is_current is False) and have to be built again."""
+
+	def __init__(self, node_ids=None, version=0):
+		self.node_ids = node_ids
+		self.version = version
+		# Map the arrays were built from, when they refuse to answer once it changes (see check_map)
+		self.map = None
+		# Intersection ID -> array index, built on first use
+		self._index = None
+
+	def index_of(self, node):
+		"""Array index of an intersection ID"""
+		return node if self.node_ids is None else self._node_index()[node]
+
+	def _node_index(self):
+		if self._index is None:
+			self._index = {node: i for i, node in enumerate(self.node_ids.tolist())}
+		return self._index
+
+	def node_of(self, i):
+		"""Intersection ID of an array index"""
+		return i if self.node_ids is None else self.node_ids[i].item()
+
+	def is_current(self, M):
+		"""Whether the arrays were built from the current version of M (a Map or a CSRGraph)"""
+		return self.version == M.version
+
+	def check_current(self, M):
+		"""Raises ValueError when the arrays were built from another version of M"""
+		if not self.is_current(M):
+			raise ValueError("{} was built for version {} of the map, which is now at version {}: build it again".format(
+				type(self).__name__, self.version, M.version))
+
+	def check_map(self):
+		"""Raises ValueError when self.map (if set) changed since the arrays were built"""
+		if self.map is not None:
+			self.check_current(self.map)
+
+
+class CSRGraph(NodeIndex):
+	"""Compressed sparse row adjacency of a road map.
+
+	The neighbors of the intersection at index i are neighbors[offsets[i]:offsets[i + 1]] and the
+	length of each of those roads is in weights at the same positions. coords is an (N, 2) array of
+	the intersection positions. node_ids[i] is the intersection ID at index i (None when the IDs are
+	0..N-1). It exposes the same intersections / roads interface as Map so PathPlanner can run on it."""
+
+	def __init__(self, offsets, neighbors, weights, coords, node_ids=None, version=0):
+		NodeIndex.__init__(self, node_ids, version)
+		self.offsets = offsets
+		self.neighbors = neighbors
+		self.weights = weights
+		self.coords = coords
+		self._lists = None
+		self.intersections = _IntersectionsView(self)
+		self.roads = _RoadsView(self)
+
+	@classmethod
+	def from_adjacency(cls, node_ids, positions, adjacency):
+		"""Builds the CSR arrays from a list of node IDs, their (x, y) positions and their neighbor lists"""
+		n = len(node_ids)
+		identity = all(node == i for i, node in enumerate(node_ids))
+		index = None if identity else {node: i for i, node in enumerate(node_ids)}
+
+		degrees = np.fromiter((len(neighbors) for neighbors in adjacency), dtype=np.int64, count=n)
+		n_edges = int(degrees.sum())
+		index_type = np.int32 if n_edges < 2**31 else np.int64
+		offsets = np.zeros(n + 1, dtype=index_type)
+		np.cumsum(degrees, out=offsets[1:])
+
+		flat = itertools.chain.from_iterable(adjacency)
+		if index is not None:
+			flat = (index[node] for node in flat)
+		neighbors = np.fromiter(flat, dtype=np.int32, count=n_edges)
+
+		coords = np.array(positions, dtype=np.float64).reshape(n, 2)
+		weights = edge_lengths(coords, np.repeat(np.arange(n), degrees), neighbors)
+		return cls(offsets, neighbors, weights, coords, None if identity else np.array(node_ids))
+
+	def __len__(self):
+		return len(self.coords)
+
+	def neighbor_costs(self, node):
+		"""Returns (neighbor, road length) pairs of an intersection"""
+		i = self.index_of(node)
+		start, end = self.offsets[i], self.offsets[i + 1]
+		neighbors = self.neighbors[start:end].tolist()
+		if self.node_ids is not None:
+			neighbors = self.node_ids[neighbors].tolist()
+		return zip(neighbors, self.weights[start:end].tolist())
+
+	def shortest_distances(self, source):
+		"""Dijkstra from the array index source, returns the distance to every array index (inf when unreachable)"""
+		return self.shortest_path_tree(source)[0]
+
+	def shortest_path_tree(self, source, targets=None):
+		"""Dijkstra from the array index source, returns (distances, predecessors) arrays by array index:
+		the distance from source (inf when unreachable) and the previous index on a shortest path (-1 for
+		source and the unreachable ones). When targets (array indices) is given, the search stops once
+		they are all settled, the entries of the other indices may then be unfinished"""
+		offsets, neighbors, weights = self._adjacency_lists()
+		distances = [math.inf] * len(self)
+		predecessors = [-1] * len(self)
+		distances[source] = 0.0
+		remaining = None if targets is None else set(targets)
+		heap = [(0.0, source)]
+		while heap:
+			d, i = heapq.heappop(heap)
+			if d > distances[i]:
+				continue
+			if remaining is not None:
+				remaining.discard(i)
+				if not remaining:
+					break
+			for k in range(offsets[i], offsets[i + 1]):
+				j = neighbors[k]
+				candidate = d + weights[k]
+				if candidate < distances[j]:
+					distances[j] = candidate
+					predecessors[j] = i
+					heapq.heappush(heap, (candidate, j))
+		return np.array(distances), np.array(predecessors, dtype=np.int64)
+
+	def _adjacency_lists(self):
+		"""Python lists of offsets, neighbors and weights (built on first use), indexing them is much faster
+		than indexing the numpy arrays in a search loop"""
+		if self._lists is None:
+			self._lists = (self.offsets.tolist(), self.neighbors.tolist(), self.weights.tolist())
+		return self._lists
+
+	def nbytes(self):
+		"""Memory used by the arrays"""
+		arrays = [self.offsets, self.neighbors, self.weights, self.coords]
+		if self.node_ids is not None:
+			arrays.append(self.node_ids)
+		return sum(array.nbytes for array in arrays)
+
+	def to_map(self):
+		"""Returns the graph as a networkx backed Map"""
+		map_dict = {node: {'pos': self.intersections[node], 'connections': self.roads[node]} for node in self.intersections}
+		M = Map(load_map_graph(map_dict))
+		M.version = self.version
+		return M
+
+	def save(self, filename):
+		"""Writes the graph in the binary map format: a MAP_HEADER followed by the offsets, neighbors,
+		weights, coords and (if any) node_ids arrays, each one starting on a MAP_ALIGNMENT boundary"""
+		flags = MAP_NODE_IDS if self.node_ids is not None else 0
+		if self.offsets.dtype == np.int64:
+			flags |= MAP_INT64_OFFSETS
+		arrays = [self.offsets, self.neighbors, self.weights, self.coords, self.node_ids]
+		header = MAP_HEADER.pack(MAP_MAGIC, MAP_FORMAT_VERSION, flags, len(self), len(self.neighbors), self.version)
+		with open(filename, 'wb') as f:
+			f.write(header)
+			position = len(header)
+			for (dtype, shape), array in zip(_binary_map_layout(flags, len(self), len(self.neighbors)), arrays):
+				padding = -position % MAP_ALIGNMENT
+				data = np.ascontiguousarray(array, dtype=dtype).reshape(shape)
+				f.write(b'\0' * padding)
+				f.write(data.tobytes())
+				position += padding + data.nbytes
+
+	@classmethod
+	def load(cls, filename, mmap=True):
+		"""Reads a graph written by save. With mmap the arrays are read only views of the file mapped in
+		memory: loading does not depend on the size of the map and processes reading the same file share its pages"""
+		with open(filename, 'rb') as f:
+			header = f.read(MAP_HEADER.size)
+		if len(header) < MAP_HEADER.size or header[:len(MAP_MAGIC)] != MAP_MAGIC:
+			raise ValueError("Not a binary map file: {}".format(filename))
+		magic, format_version, flags, n, n_edges, version = MAP_HEADER.unpack(header)
+		if format_version != MAP_FORMAT_VERSION:
+			raise ValueError("Unsupported binary map format version {}".format(format_version))
+
+		data = np.memmap(filename, dtype=np.uint8, mode='r') if mmap else np.fromfile(filename, dtype=np.uint8)
+		arrays = []
+		position = MAP_HEADER.size
+		for dtype, shape in _binary_map_layout(flags, n, n_edges):
+			position += -position % MAP_ALIGNMENT
+			size = dtype.itemsize * int(np.prod(shape))
+			if position + size > len(data):
+				raise ValueError("Truncated binary map file: {}".format(filename))
+			arrays.append(data[position:position + size].view(dtype).reshape(shape))
+			position += size
+
+		return cls(*arrays, version=version)
+
+
+def shortest_path_tree(M, source):
+	"""Distances and predecessors from the intersection source to every intersection of M (a Map or a
+	CSRGraph), in a single Dijkstra over the road lengths PathPlanner uses. Both are arrays by array index
+	(CSRGraph.index_of, the intersection ID itself on the maps with IDs 0..N-1), see tree_path"""
+	csr = as_csr(M)
+	return csr.shortest_path_tree(csr.index_of(source))
+
+def tree_path(M, tree, target):
+	"""Path of intersection IDs from the source of tree (a shortest_path_tree of M) to target, None if unreachable"""
+	csr = as_csr(M)
+	distances, predecessors = tree
+	i = csr.index_of(target)
+	if distances[i] == math.inf:
+		return None
+	path = [i]
+	while predecessors[path[-1]] >= 0:
+		path.append(int(predecessors[path[-1]]))
+	return [csr.node_of(i) for i in reversed(path)]
+
+def distance_matrix(M, sources, targets):
+	"""(len(sources), len(targets)) array of the road distances between two small sets of intersections
+	of M, one Dijkstra per source which stops once all the targets are settled"""
+	csr = as_csr(M)
+	target_indices = [csr.index_of(target) for target in targets]
+	matrix = np.empty((len(sources), len(target_indices)))
+	for row, source in enumerate(sources):
+		distances = csr.shortest_path_tree(csr.index_of(source), target_indices)[0]
+		matrix[row] = distances[target_indices]
+	return matrix
+
+
+def _binary_map_layout(flags, n, n_edges):
+	"""(dtype, shape) of the arrays of the binary map format, in file order"""
+	layout = [
+		(np.int64 if flags & MAP_INT64_OFFSETS else np.int32, (n + 1,)),
+		(np.int32, (n_edges,)),
+		(np.float64, (n_edges,)),
+		(np.float64, (n, 2)),
+	]
+	if flags & MAP_NODE_IDS:
+		layout.append((np.int64, (n,)))
+	return [(np.dtype(dtype).newbyteorder('<'), shape) for dtype, shape in layout]
+
+
+def edge_lengths(coords, sources, targets):
+	"""Euclidean length of the roads sources[k] -> targets[k] (same formula as PathPlanner.distance)"""
+	d = coords[targets] - coords[sources]
+	return np.sqrt(d[:, 0]**2 + d[:, 1]**2)
+
+
+class _IntersectionsView:
+	"""Read only dict-like view {intersection ID: (x, y)} over the coordinates of a CSRGraph"""
+	def __init__(self, graph):
+		self._graph = graph
+
+	def __getitem__(self, node):
+		return tuple(self._graph.coords[self._graph.index_of(node)].tolist())
+
+	def __len__(self):
+		return len(self._graph)
+
+	def __iter__(self):
+		graph = self._graph
+		return iter(range(len(graph)) if graph.node_ids is None else graph.node_ids.tolist())
+
+	def __contains__(self, node):
+		graph = self._graph
+		if graph.node_ids is not None:
+			return node in graph._node_index()
+		return isinstance(node, int) and 0 <= node < len(graph)
+
+	def keys(self):
+		return iter(self)
+
+	def items(self):
+		return ((node, self[node]) for node in self)
+
+
+class _RoadsView:
+	"""Read only list-like view where roads[node] is the list of neighbors of an intersection"""
+	def __init__(self, graph):
+		self._graph = graph
+
+	def __getitem__(self, node):
+		return [neighbor for neighbor, _ in self._graph.neighbor_costs(node)]
+
+	def __len__(self):
+		return len(self._graph)
+
+	def __iter__(self):
+		return (self[node] for node in self._graph.intersections)
+
+
 def load_map_graph(map_dict):
 	G = nx.Graph()
-	for node in map_dict.keys():
-		G.add_node(node, pos=map_dict[node]['pos'])
-	for node in map_dict.keys():
-		for con_node in map_dict[node]['connections']:
-			G.add_edge(node, con_node)
+	G.add_nodes_from((node, {'pos': map_dict[node]['pos']}) for node in map_dict.keys())
+	G.add_edges_from((node, con_node) for node in map_dict.keys() for con_node in map_dict[node]['connections'])
 	return G
 
 def load_map_10():
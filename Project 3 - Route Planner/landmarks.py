@@ -0,0 +1,90 @@
+"""ALT (A*, landmarks, triangle inequality) lower bounds for PathPlanner.
+
+An offline step picks K landmark intersections and stores the road distance from each of them to
+every intersection. For any landmark L the triangle inequality gives |d(L, goal) - d(L, node)| <=
+d(node, goal), so the largest of these K bounds is an admissible heuristic, usually much closer to
+the road distance than the straight line on sparse maps. From the notebook:
+
+    from landmarks import Landmarks
+    landmarks = Landmarks.build(map_40, k=8)
+    landmarks.save('map_40_landmarks.npz')
+    planner = PathPlanner(map_40, 5, 34, landmarks=landmarks)
+
+The distances are stored as an (N, K) float32 table, the K distances of an intersection are
+contiguous. PathPlanner refuses tables built before a change of the map (NodeIndex.is_current).
+"""
+import numpy as np
+
+from helpers import NodeIndex, as_csr
+
+# float32 rounding of a distance d is at most d * FLOAT32_EPS, the bounds are lowered by that much
+FLOAT32_EPS = float(np.finfo(np.float32).eps)
+
+
+class Landmarks(NodeIndex):
+    """Landmark distance tables of a map"""
+    def __init__(self, distances, landmarks, node_ids=None, version=0):
+        NodeIndex.__init__(self, node_ids, version)
+        # distances[i, k] is the road distance between landmark k and the intersection at index i
+        self.distances = distances
+        # Array indices of the landmarks
+        self.landmarks = landmarks
+        self._goal = None
+        self._goal_distances = None
+
+    @classmethod
+    def build(cls, M, k=16, seed=0):
+        """Picks k landmarks on M (a Map or a CSRGraph) far apart from each other and computes their tables.
+        The first landmark is the farthest intersection from a random one, each next one is the intersection
+        farthest from all the landmarks picked so far (an intersection they cannot reach comes first)."""
+        csr = as_csr(M)
+        n = len(csr)
+        k = min(k, n)
+        rng = np.random.default_rng(seed)
+
+        closest = csr.shortest_distances(int(rng.integers(n)))
+        landmarks = []
+        columns = []
+        for i in range(k):
+            landmark = int(np.argmax(closest))
+            if landmarks and closest[landmark] == 0:
+                break
+            distances = csr.shortest_distances(landmark)
+            landmarks.append(landmark)
+            columns.append(distances.astype(np.float32))
+            closest = distances if i == 0 else np.minimum(closest, distances)
+
+        return cls(np.ascontiguousarray(np.column_stack(columns)), np.array(landmarks, dtype=np.int32),
+                   csr.node_ids, M.version)
+
+    def __len__(self):
+        """Number of landmarks"""
+        return len(self.landmarks)
+
+    def estimate(self, node, goal):
+        """Lower bound of the road distance between node and goal (0 when no landmark gives one)"""
+        if goal != self._goal:
+            self._goal = goal
+            self._goal_distances = self.distances[self.index_of(goal)].astype(np.float64)
+        to_goal = self._goal_distances
+        to_node = self.distances[self.index_of(node)]
+        # Landmarks that cannot reach both nodes give nan, fmax skips them
+        with np.errstate(invalid='ignore'):
+            bound = np.fmax.reduce(np.abs(to_goal - to_node) - FLOAT32_EPS * (to_goal + to_node))
+        return float(bound) if bound > 0 else 0.0
+
+    def nbytes(self):
+        """Memory used by the tables"""
+        return self.distances.nbytes + self.landmarks.nbytes + (0 if self.node_ids is None else self.node_ids.nbytes)
+
+    def save(self, filename):
+        arrays = {'distances': self.distances, 'landmarks': self.landmarks, 'version': self.version}
+        if self.node_ids is not None:
+            arrays['node_ids'] = self.node_ids
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            node_ids = data['node_ids'] if 'node_ids' in data.files else None
+            return cls(data['distances'], data['landmarks'], node_ids, int(data['version']))
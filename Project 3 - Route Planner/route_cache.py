@@ -0,0 +1,129 @@
+"""Bounded LRU cache of planned routes.
+
+Routes are keyed on (map version, start, goal). Map.version changes with every add / remove of an
+intersection or a road, so the routes planned on an older version of the map are dropped on the
+next lookup. Like test.py, the planner class is an argument:
+
+    from route_cache import RouteCache
+    routes = RouteCache(PathPlanner, map_40, maxsize=1024, reuse_subpaths=True)
+    path, cost = routes.get(5, 34)
+
+With reuse_subpaths, a query whose start and goal both lie on a cached path is answered with the
+piece of that path between them: every part of a shortest path is itself a shortest path. The
+roads of a Map go both ways, so the piece can also be read backwards.
+"""
+import collections
+import math
+
+CacheInfo = collections.namedtuple('CacheInfo',
+    ['hits', 'subpath_hits', 'misses', 'evictions', 'invalidations', 'size', 'maxsize'])
+
+
+class RouteCache():
+    """Paths and costs of the routes planned on a map, the least recently used ones are evicted first"""
+    def __init__(self, planner_class, M, maxsize=1024, reuse_subpaths=False):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.planner_class = planner_class
+        self.map = M
+        self.maxsize = maxsize
+        self.reuse_subpaths = reuse_subpaths
+        self.clear()
+
+    def clear(self):
+        """Empties the cache and resets its counters"""
+        # (start, goal) -> (path, cumulative costs along the path), in least to most recently used order
+        self._routes = collections.OrderedDict()
+        # node -> {(start, goal): position of the node on that cached path}, only with reuse_subpaths
+        self._paths_through = {}
+        self._version = self.map.version
+        self.hits = self.subpath_hits = self.misses = self.evictions = self.invalidations = 0
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.subpath_hits, self.misses, self.evictions,
+                         self.invalidations, len(self._routes), self.maxsize)
+
+    def get(self, start, goal):
+        """Returns (path, cost) of the shortest route from start to goal, (None, inf) when there is none"""
+        if self.map.version != self._version:
+            self._invalidate()
+
+        key = (start, goal)
+        route = self._routes.get(key)
+        if route is not None:
+            self._routes.move_to_end(key)
+            self.hits += 1
+        else:
+            route = self._find_subpath(start, goal) if self.reuse_subpaths else None
+            if route is not None:
+                self.subpath_hits += 1
+                self._insert(key, route, index=False)
+            else:
+                self.misses += 1
+                route = self._plan(start, goal)
+                self._insert(key, route, index=self.reuse_subpaths)
+
+        path, costs = route
+        if path is None:
+            return None, math.inf
+        return list(path), costs[-1] - costs[0]
+
+    def path(self, start, goal):
+        """Returns the shortest path from start to goal, None when there is none"""
+        return self.get(start, goal)[0]
+
+    def _plan(self, start, goal):
+        planner = self.planner_class(self.map, start, goal)
+        if not planner.path:
+            return None, None
+        # Every node of the path was reached through the path, so its gScore is its distance from start
+        return tuple(planner.path), tuple(planner.gScore[node] for node in planner.path)
+
+    def _find_subpath(self, start, goal):
+        through_start = self._paths_through.get(start)
+        through_goal = self._paths_through.get(goal)
+        if not through_start or not through_goal:
+            return None
+        if len(through_goal) < len(through_start):
+            through_start, through_goal = through_goal, through_start
+            swapped = True
+        else:
+            swapped = False
+
+        for key, i in through_start.items():
+            j = through_goal.get(key)
+            if j is None:
+                continue
+            if swapped:
+                i, j = j, i
+            path, costs = self._routes[key]
+            if i <= j:
+                return path[i:j + 1], costs[i:j + 1]
+            # Read backwards, the costs are counted from the end of the piece
+            total = costs[i]
+            return path[j:i + 1][::-1], tuple(total - cost for cost in costs[j:i + 1][::-1])
+        return None
+
+    def _insert(self, key, route, index):
+        self._routes[key] = route
+        path = route[0]
+        if index and path is not None:
+            for i, node in enumerate(path):
+                self._paths_through.setdefault(node, {})[key] = i
+        if len(self._routes) > self.maxsize:
+            self._evict()
+
+    def _evict(self):
+        key, (path, costs) = self._routes.popitem(last=False)
+        self.evictions += 1
+        if path is not None:
+            for node in path:
+                through = self._paths_through.get(node)
+                if through is not None and through.pop(key, None) is not None and not through:
+                    del self._paths_through[node]
+
+    def _invalidate(self):
+        self._routes.clear()
+        self._paths_through.clear()
+        self._version = self.map.version
+        self.invalidations += 1
@@ -0,0 +1,182 @@
+"""Uniform grid index over the intersection coordinates, to snap raw (x, y) positions to intersections.
+
+The bounding box of the intersections is cut into square cells holding points_per_cell intersections
+on average. The intersections are sorted by cell, so the ones of a cell are contiguous (CSR layout,
+like CSRGraph), and a query only looks at the cells around the position:
+
+    from spatial_index import GridIndex
+    index = GridIndex.from_map(map_40)
+    start = index.nearest(0.5, 0.5)
+    starts, distances = index.nearest_batch(positions)    # (Q, 2) array of positions
+
+An index built by from_map raises ValueError instead of answering once the map changes.
+"""
+import heapq
+import math
+
+import numpy as np
+
+from helpers import NodeIndex, as_csr
+
+
+class GridIndex(NodeIndex):
+    """Nearest, k nearest and radius queries over a set of points"""
+    def __init__(self, coords, node_ids=None, points_per_cell=2.0, version=0):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        n = len(coords)
+        self.lower = coords.min(axis=0) if n else np.zeros(2)
+        extent = coords.max(axis=0) - self.lower if n else np.zeros(2)
+        side = max(1, int(math.ceil(math.sqrt(n / points_per_cell))))
+        self.cell_size = float(extent.max()) / side or 1.0
+        # Number of cells along x and y
+        self.shape = tuple(int(cells) for cells in np.maximum(np.ceil(extent / self.cell_size), 1))
+
+        cells = self._cells_of(coords)
+        flat = cells[:, 0] * self.shape[1] + cells[:, 1]
+        order = np.argsort(flat, kind='stable')
+        # The points of cell (i, j) are coords[cell_offsets[c]:cell_offsets[c + 1]] with c = i * shape[1] + j
+        self.cell_offsets = np.zeros(self.shape[0] * self.shape[1] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(flat, minlength=self.shape[0] * self.shape[1]), out=self.cell_offsets[1:])
+        self.coords = coords[order]
+        # The array indices are the positions of the sorted points
+        NodeIndex.__init__(self, order if node_ids is None else np.asarray(node_ids)[order], version)
+        # Python lists of the arrays for the scalar queries, as in CSRGraph._adjacency_lists
+        self._lists = (self.cell_offsets.tolist(), self.coords[:, 0].tolist(), self.coords[:, 1].tolist(),
+                       self.node_ids.tolist())
+
+    @classmethod
+    def from_map(cls, M, points_per_cell=2.0):
+        """Index of the intersections of M (a Map or a CSRGraph), its queries are refused once M changes"""
+        csr = as_csr(M)
+        index = cls(csr.coords, csr.node_ids, points_per_cell, M.version)
+        index.map = M
+        return index
+
+    def __len__(self):
+        return len(self.coords)
+
+    def _cells_of(self, points):
+        """(i, j) cells of an (N, 2) array of points, clipped to the grid"""
+        cells = np.floor((points - self.lower) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, np.array(self.shape) - 1)
+
+    def _block_bound(self, x, y, ci, cj, r):
+        """Distance from (x, y) to the closest point outside the block of cells within r of (ci, cj).
+        Sides of the block on the edge of the grid have no points beyond them"""
+        lower_x, lower_y = self.lower
+        size = self.cell_size
+        nx, ny = self.shape
+        return min(x - (lower_x + (ci - r) * size) if ci - r > 0 else math.inf,
+                   lower_x + (ci + r + 1) * size - x if ci + r < nx - 1 else math.inf,
+                   y - (lower_y + (cj - r) * size) if cj - r > 0 else math.inf,
+                   lower_y + (cj + r + 1) * size - y if cj + r < ny - 1 else math.inf)
+
+    def _ring(self, ci, cj, r):
+        """Cells at Chebyshev distance r of (ci, cj), clipped to the grid"""
+        nx, ny = self.shape
+        j_range = range(max(cj - r, 0), min(cj + r, ny - 1) + 1)
+        for i in range(max(ci - r, 0), min(ci + r, nx - 1) + 1):
+            if r == 0 or abs(i - ci) == r:
+                for j in j_range:
+                    yield i * ny + j
+            else:
+                for j in (cj - r, cj + r):
+                    if 0 <= j < ny:
+                        yield i * ny + j
+
+    def k_nearest(self, x, y, k):
+        """IDs of the k intersections nearest to (x, y), nearest first"""
+        self.check_map()
+        ids = self._lists[3]
+        return [ids[p] for _, p in self._k_nearest_points(x, y, k)]
+
+    def _k_nearest_points(self, x, y, k):
+        """(squared distance, sorted point index) of the k points nearest to (x, y), nearest first"""
+        if len(self) == 0 or k < 1:
+            return []
+        offsets, xs, ys, _ = self._lists
+        ci, cj = self._cells_of(np.array([[x, y]]))[0].tolist()
+        # Max heap of the k nearest points found so far, as (-squared distance, point)
+        found = []
+        r = 0
+        while True:
+            for cell in self._ring(ci, cj, r):
+                for p in range(offsets[cell], offsets[cell + 1]):
+                    d2 = (xs[p] - x) ** 2 + (ys[p] - y) ** 2
+                    if len(found) < k:
+                        heapq.heappush(found, (-d2, p))
+                    elif d2 < -found[0][0]:
+                        heapq.heapreplace(found, (-d2, p))
+            bound = self._block_bound(x, y, ci, cj, r)
+            if bound == math.inf or (len(found) == k and -found[0][0] <= bound * bound):
+                break
+            r += 1
+        return [(-d2, p) for d2, p in sorted(found, reverse=True)]
+
+    def nearest(self, x, y):
+        """ID of the intersection nearest to (x, y), None when there is none"""
+        nearest = self.k_nearest(x, y, 1)
+        return nearest[0] if nearest else None
+
+    def within_radius(self, x, y, radius):
+        """IDs of the intersections within radius of (x, y), nearest first"""
+        self.check_map()
+        offsets, xs, ys, ids = self._lists
+        nx, ny = self.shape
+        (i_min, j_min), (i_max, j_max) = self._cells_of(np.array([[x - radius, y - radius], [x + radius, y + radius]])).tolist()
+        r2 = radius * radius
+        found = []
+        for i in range(i_min, i_max + 1):
+            for cell in range(i * ny + j_min, i * ny + j_max + 1):
+                for p in range(offsets[cell], offsets[cell + 1]):
+                    d2 = (xs[p] - x) ** 2 + (ys[p] - y) ** 2
+                    if d2 <= r2:
+                        found.append((d2, p))
+        found.sort()
+        return [ids[p] for _, p in found]
+
+    def nearest_batch(self, points):
+        """Nearest intersection of each row of an (Q, 2) array of positions, returns (IDs, distances) arrays.
+        The 3x3 cells around every position are searched at once with numpy, the rare positions whose
+        nearest intersection may lie further away fall back to k_nearest"""
+        self.check_map()
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        q = len(points)
+        if len(self) == 0:
+            raise ValueError("nearest_batch on an empty index")
+        nx, ny = self.shape
+        cells = self._cells_of(points)
+
+        queries, candidates = [], []
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                i, j = cells[:, 0] + di, cells[:, 1] + dj
+                valid = np.flatnonzero((i >= 0) & (i < nx) & (j >= 0) & (j < ny))
+                flat = i[valid] * ny + j[valid]
+                starts = self.cell_offsets[flat]
+                counts = self.cell_offsets[flat + 1] - starts
+                # Point indices starts[m]..starts[m] + counts[m] - 1 for every query m, flattened
+                first = np.cumsum(counts) - counts
+                queries.append(np.repeat(valid, counts))
+                candidates.append(np.repeat(starts - first, counts) + np.arange(counts.sum()))
+        queries, candidates = np.concatenate(queries), np.concatenate(candidates)
+
+        d2 = ((self.coords[candidates] - points[queries]) ** 2).sum(axis=1)
+        order = np.lexsort((d2, queries))
+        found, first = np.unique(queries[order], return_index=True)
+        best = np.full(q, -1, dtype=np.int64)
+        best_d2 = np.full(q, np.inf)
+        best[found] = candidates[order[first]]
+        best_d2[found] = d2[order[first]]
+
+        # Distance to the outside of the 3x3 block, infinite on the sides at the edge of the grid
+        lower_edge = self.lower + (cells - 1) * self.cell_size
+        upper_edge = self.lower + (cells + 2) * self.cell_size
+        bound = np.minimum(np.where(cells - 1 > 0, points - lower_edge, np.inf),
+                           np.where(cells + 1 < np.array(self.shape) - 1, upper_edge - points, np.inf)).min(axis=1)
+        unresolved = np.flatnonzero(best_d2 > bound * bound)
+
+        for m in unresolved.tolist():
+            x, y = points[m].tolist()
+            best_d2[m], best[m] = self._k_nearest_points(x, y, 1)[0]
+        return self.node_ids[best], np.sqrt(best_d2)
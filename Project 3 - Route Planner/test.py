@@ -1,4 +1,15 @@
-from helpers import load_map_40
+import math
+import os
+import tempfile
+
+import numpy as np
+
+from batch_planner import plan_many
+from contraction import ContractionHierarchy
+from helpers import CSRGraph, Map, distance_matrix, load_map_40, shortest_path_tree, tree_path
+from landmarks import Landmarks
+from route_cache import RouteCache
+from spatial_index import GridIndex
 
 MAP_40_ANSWERS = [
     (5, 34, [5, 16, 37, 12, 34]),
@@ -22,4 +33,332 @@ def test(shortest_path_function):
         print("All tests pass! Congratulations!")
     else:
         print("You passed", correct, "/", len(MAP_40_ANSWERS), "test cases")
-    
\ No newline at end of file
+    
+
+def path_cost(M, path):
+    """Length of a path on a Map or a CSRGraph, None when two consecutive intersections are not connected"""
+    cost = 0
+    for node_1, node_2 in zip(path, path[1:]):
+        if node_2 not in M.roads[node_1]:
+            return None
+        (x1, y1), (x2, y2) = M.intersections[node_1], M.intersections[node_2]
+        cost += math.hypot(x2 - x1, y2 - y1)
+    return cost
+
+def shortest_cost(M, start, goal):
+    """Road distance between two intersections, from a Dijkstra over the whole map"""
+    csr = M.to_csr()
+    return float(shortest_path_tree(csr, start)[0][csr.index_of(goal)])
+
+def check_shortest_paths(planner_class, M, **planner_args):
+    """Paths of the planner on M are the MAP_40_ANSWERS (M is map_40) and shortest ones for all the pairs"""
+    for start, goal, answer_path in MAP_40_ANSWERS:
+        path = planner_class(M, start, goal, **planner_args).path
+        assert path == answer_path, "Path {} from {} to {} differs from the answer".format(path, start, goal)
+    for start in M.intersections:
+        distances = shortest_path_tree(M, start)[0]
+        for goal in M.intersections:
+            path = planner_class(M, start, goal, **planner_args).path
+            assert path[0] == start and path[-1] == goal, "Path {} does not go from {} to {}".format(path, start, goal)
+            cost = path_cost(M, path)
+            assert cost is not None, "Path {} uses a road which does not exist".format(path)
+            assert math.isclose(cost, distances[goal], abs_tol=1e-12), "Path {} is not a shortest one".format(path)
+
+def test_open_set(planner_class):
+    """The heap open set hands out nodes by lowest priority, skipping removed nodes and stale priorities"""
+    map_40 = load_map_40()
+    check_shortest_paths(planner_class, map_40)
+
+    open_set_class = type(planner_class(map_40, 5, 34).openSet)
+    priorities = {'a': 3, 'b': 1, 'c': 2}
+    open_set = open_set_class(['a'])
+    for node in 'bc':
+        open_set.push(node, priorities[node])
+    open_set.push('a', priorities['a'])
+    assert len(open_set) == 3 and 'a' in open_set, "OpenSet does not hold the pushed nodes"
+    assert open_set.peek(priorities.get) == 'b', "OpenSet.peek does not return the lowest priority"
+    open_set.remove('b')
+    assert 'b' not in open_set and open_set.peek(priorities.get) == 'c', "OpenSet.remove does not remove the node"
+    # Lower priority pushed again (decrease-key), the older entry of the node is skipped
+    priorities['a'] = 0
+    open_set.push('a', 0)
+    assert open_set.peek(priorities.get) == 'a', "OpenSet.push does not lower the priority"
+    open_set.remove('a')
+    open_set.remove('c')
+    assert len(open_set) == 0 and not open_set, "OpenSet is not empty after removing all its nodes"
+    print("Open set tests pass!")
+
+def test_csr(planner_class):
+    """A CSRGraph holds the same intersections and roads as the Map, and gives the same paths"""
+    map_40 = load_map_40()
+    csr = map_40.to_csr()
+    assert map_40.to_csr() is csr, "Map.to_csr is not cached"
+    for node in map_40.intersections:
+        assert csr.intersections[node] == tuple(map_40.intersections[node]), "CSRGraph intersection {} differs".format(node)
+        assert sorted(csr.roads[node]) == sorted(map_40.roads[node]), "CSRGraph roads of {} differ".format(node)
+        for neighbor, cost in csr.neighbor_costs(node):
+            assert math.isclose(cost, path_cost(map_40, [node, neighbor])), "CSRGraph road length differs"
+    check_shortest_paths(planner_class, csr)
+
+    # Intersection IDs which are not 0..N-1
+    nodes = list(map_40.intersections)
+    shifted = CSRGraph.from_adjacency([node + 100 for node in nodes], [map_40.intersections[node] for node in nodes],
+                                      [[neighbor + 100 for neighbor in map_40.roads[node]] for node in nodes])
+    for start, goal, answer_path in MAP_40_ANSWERS:
+        path = planner_class(shifted, start + 100, goal + 100).path
+        assert path == [node + 100 for node in answer_path], "Path {} on a CSRGraph with other IDs differs".format(path)
+    print("CSR tests pass!")
+
+def test_search_state(planner_class):
+    """The scores only hold the nodes reached by the search, the others are at infinity"""
+    map_40 = load_map_40()
+    planner = planner_class(map_40, 5, 34)
+    assert planner.path == MAP_40_ANSWERS[0][2], "Path {} differs from the answer".format(planner.path)
+    assert set(planner.gScore) == set(planner.fScore) and len(planner.gScore) < len(map_40.intersections), \
+        "The scores hold nodes the search did not reach"
+    unreached = next(node for node in map_40.intersections if node not in planner.gScore)
+    assert planner.get_gScore(unreached) == math.inf, "The g Score of an unreached node is not infinity"
+    for node in planner.path:
+        assert math.isclose(planner.gScore[node], shortest_cost(map_40, 5, node)), "Wrong g Score on the path"
+    print("Search state tests pass!")
+
+def test_plan_many(planner_class):
+    """plan_many returns the same paths as the planner, in the order of the pairs"""
+    map_40 = load_map_40()
+    pairs = [(start, goal) for start in range(0, 40, 3) for goal in range(1, 40, 4)]
+    pairs += [(start, goal) for start, goal, answer_path in MAP_40_ANSWERS]
+    expected = [planner_class(map_40, start, goal).path for start, goal in pairs]
+    for M in (map_40, map_40.to_csr()):
+        for workers in (1, 2):
+            assert plan_many(planner_class, M, pairs, workers=workers) == expected, \
+                "plan_many paths differ from the planner with {} worker(s)".format(workers)
+    print("plan_many tests pass!")
+
+def test_route_cache(planner_class):
+    """RouteCache hits, subpath reuse and least recently used eviction"""
+    map_40 = load_map_40()
+    routes = RouteCache(planner_class, map_40, maxsize=2, reuse_subpaths=True)
+    path, cost = routes.get(8, 24)
+    assert path == MAP_40_ANSWERS[2][2], "RouteCache path differs from the answer"
+    assert math.isclose(cost, shortest_cost(map_40, 8, 24)), "RouteCache cost is not the road distance"
+    assert routes.get(8, 24) == (path, cost) and routes.cache_info().hits == 1, "RouteCache did not hit"
+
+    # 16 -> 12 and 10 -> 14 (read backwards) are pieces of 8 -> 24
+    for start, goal in ((16, 12), (10, 14)):
+        piece, piece_cost = routes.get(start, goal)
+        assert piece == planner_class(map_40, start, goal).path, "RouteCache subpath is not the shortest path"
+        assert math.isclose(piece_cost, shortest_cost(map_40, start, goal)), "RouteCache subpath cost is wrong"
+    info = routes.cache_info()
+    assert (info.subpath_hits, info.misses) == (2, 1), "RouteCache did not reuse the subpaths"
+    # maxsize is 2: 8 -> 24 was the least recently used route
+    assert (info.evictions, info.size) == (1, 2), "RouteCache did not evict the least recently used route"
+    routes.get(8, 24)
+    assert routes.cache_info().misses == 2, "RouteCache kept an evicted route"
+
+    assert routes.get(5, 5) == ([5], 0), "RouteCache route from a node to itself is wrong"
+    routes.clear()
+    assert routes.cache_info() == (0, 0, 0, 0, 0, 0, 2), "RouteCache.clear does not reset the cache"
+    print("Route cache tests pass!")
+
+def test_bidirectional(planner_class):
+    """The opt-in bidirectional mode finds shortest paths, on the Map and on its CSR graph"""
+    map_40 = load_map_40()
+    for M in (map_40, map_40.to_csr()):
+        check_shortest_paths(planner_class, M, mode="bidirectional")
+    assert planner_class(map_40, 8, 8, mode="bidirectional").path == [8], "Wrong path from a node to itself"
+    print("Bidirectional search tests pass!")
+
+def test_landmarks(planner_class):
+    """Landmark bounds never exceed the road distance, and the planner still finds shortest paths with them"""
+    map_40 = load_map_40()
+    landmarks = Landmarks.build(map_40, k=8)
+    for start in map_40.intersections:
+        distances = shortest_path_tree(map_40, start)[0]
+        for goal in map_40.intersections:
+            assert landmarks.estimate(start, goal) <= distances[goal], "Landmark bound above the road distance"
+    check_shortest_paths(planner_class, map_40, landmarks=landmarks)
+    expanded = [sum(planner_class(map_40, start, goal, landmarks=table).expanded for start, goal, answer_path in MAP_40_ANSWERS)
+                for table in (None, landmarks)]
+    assert expanded[1] <= expanded[0], "The landmarks expand more nodes than the straight line distance"
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "map_40_landmarks.npz")
+        landmarks.save(filename)
+        loaded = Landmarks.load(filename)
+    assert np.array_equal(loaded.distances, landmarks.distances) and loaded.version == map_40.version, \
+        "Landmarks differ after save and load"
+
+    # Landmarks of the map before a change are refused, rebuilt ones give shortest paths again
+    map_40.add_road(5, 34)
+    try:
+        planner_class(map_40, 5, 34, landmarks=landmarks)
+        assert False, "PathPlanner used landmarks of an older version of the map"
+    except ValueError:
+        pass
+    landmarks = Landmarks.build(map_40, k=8)
+    assert planner_class(map_40, 5, 34, landmarks=landmarks).path == [5, 34], "The new road is not used"
+    for start in map_40.intersections:
+        distances = shortest_path_tree(map_40, start)[0]
+        for goal in map_40.intersections:
+            path = planner_class(map_40, start, goal, landmarks=landmarks).path
+            assert math.isclose(path_cost(map_40, path), distances[goal], abs_tol=1e-12), \
+                "Path {} is not a shortest one after the map change".format(path)
+    print("Landmark tests pass!")
+
+def test_contraction(planner_class):
+    """Contraction hierarchy queries find the shortest routes, before and after save and load"""
+    map_40 = load_map_40()
+    hierarchy = ContractionHierarchy.build(map_40)
+    for start, goal, answer_path in MAP_40_ANSWERS:
+        path, cost = hierarchy.query(start, goal)
+        assert path == answer_path, "Wrong contraction hierarchy path from %d to %d" % (start, goal)
+        assert math.isclose(cost, path_cost(map_40, answer_path)), "Wrong contraction hierarchy cost"
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "map_40_ch.npz")
+        hierarchy.save(filename)
+        loaded = ContractionHierarchy.load(filename)
+        checked = ContractionHierarchy.load(filename, map_40)
+    for start in map_40.intersections:
+        distances = shortest_path_tree(map_40, start)[0]
+        for goal in map_40.intersections:
+            for table in (hierarchy, loaded, checked):
+                path, cost = table.query(start, goal)
+                if distances[goal] == math.inf:
+                    assert path is None and cost == math.inf, "Route found between unconnected intersections"
+                    continue
+                assert path[0] == start and path[-1] == goal, "Contraction hierarchy path has the wrong ends"
+                assert math.isclose(path_cost(map_40, path), cost), "Unpacked path does not have the query cost"
+                assert math.isclose(cost, distances[goal], abs_tol=1e-9), \
+                    "Contraction hierarchy route from %d to %d is not the shortest" % (start, goal)
+
+    # After a change of the map the hierarchies checked against it refuse to answer, a rebuilt one
+    # takes the new road
+    map_40.add_road(5, 34)
+    for table in (hierarchy, checked):
+        try:
+            table.query(5, 34)
+            assert False, "A contraction hierarchy of an older version of the map answered"
+        except ValueError:
+            pass
+    assert ContractionHierarchy.build(map_40).query(5, 34)[0] == [5, 34], "The new road is not used"
+    print("Contraction hierarchy tests pass!")
+
+def test_spatial_index(planner_class):
+    """Grid index queries agree with a scan of all the intersections"""
+    map_40 = load_map_40()
+    index = GridIndex.from_map(map_40)
+    ids = list(map_40.intersections)
+    coords = np.array([map_40.intersections[node] for node in ids])
+    rng = np.random.default_rng(0)
+    # Positions inside and around the map
+    points = rng.uniform(coords.min(axis=0) - 0.2, coords.max(axis=0) + 0.2, size=(200, 2))
+    for x, y in points:
+        distances = np.hypot(coords[:, 0] - x, coords[:, 1] - y)
+        ordered = np.sort(distances)
+        by_id = dict(zip(ids, distances))
+
+        nearest = index.nearest(x, y)
+        assert math.isclose(by_id[nearest], ordered[0]), "nearest is not the nearest intersection"
+        k_nearest = index.k_nearest(x, y, 5)
+        assert np.allclose([by_id[node] for node in k_nearest], ordered[:5]), "k_nearest is not the 5 nearest"
+        # Halfway between two distances, so rounding does not decide which side an intersection falls on
+        radius = (ordered[7] + ordered[8]) / 2
+        within = index.within_radius(x, y, radius)
+        assert sorted(within) == sorted(node for node in ids if by_id[node] <= radius), \
+            "within_radius does not find the intersections within the radius"
+
+    nearest, distances = index.nearest_batch(points)
+    expected = np.hypot(coords[:, 0] - points[:, :1], coords[:, 1] - points[:, 1:]).min(axis=1)
+    assert np.allclose(distances, expected), "nearest_batch distances are not the nearest ones"
+    assert all(math.isclose(math.hypot(*np.subtract(map_40.intersections[node], point)), distance)
+               for node, point, distance in zip(nearest.tolist(), points, distances)), \
+        "nearest_batch IDs do not match their distances"
+
+    # Once the map changes the index refuses to answer, a rebuilt one no longer finds a removed intersection
+    x, y = map_40.intersections[nearest[0]]
+    map_40.remove_intersection(nearest[0])
+    for query in (lambda: index.nearest(x, y), lambda: index.k_nearest(x, y, 2),
+                  lambda: index.within_radius(x, y, 0.1), lambda: index.nearest_batch(points)):
+        try:
+            query()
+            assert False, "A grid index of an older version of the map answered"
+        except ValueError:
+            pass
+    assert GridIndex.from_map(map_40).nearest(x, y) != nearest[0], "The removed intersection was found"
+    print("Spatial index tests pass!")
+
+def test_shortest_path_tree(planner_class):
+    """One Dijkstra tree gives the answer paths, and distance_matrix the planner's path costs"""
+    map_40 = load_map_40()
+    for start, goal, answer_path in MAP_40_ANSWERS:
+        tree = shortest_path_tree(map_40, start)
+        assert tree_path(map_40, tree, goal) == answer_path, "Wrong tree path from %d to %d" % (start, goal)
+        planner_path = planner_class(map_40, start, goal).path
+        assert math.isclose(tree[0][goal], path_cost(map_40, planner_path)), "Tree distance is not the planner's path cost"
+
+    for M in (map_40, map_40.to_csr()):
+        sources, targets = [5, 8, 33], [34, 24, 5, 0]
+        matrix = distance_matrix(M, sources, targets)
+        assert matrix.shape == (len(sources), len(targets)), "Wrong distance matrix shape"
+        for row, source in enumerate(sources):
+            for column, target in enumerate(targets):
+                assert math.isclose(matrix[row, column], shortest_cost(map_40, source, target), abs_tol=1e-9), \
+                    "Wrong distance from %d to %d" % (source, target)
+    print("Shortest path tree tests pass!")
+
+def test_map_changes(planner_class):
+    """Routes planned (and cached) before a change of the map are not reused after it"""
+    map_40 = load_map_40()
+    routes = RouteCache(planner_class, map_40)
+    for start, goal, answer_path in MAP_40_ANSWERS:
+        assert routes.path(start, goal) == answer_path, "RouteCache path differs from the answer"
+
+    # 16-37 is on the routes 5 -> 34 and 8 -> 24
+    map_40.remove_road(16, 37)
+    map_40.remove_intersection(3)
+    for start, goal, answer_path in MAP_40_ANSWERS:
+        path, cost = routes.get(start, goal)
+        assert path == planner_class(map_40, start, goal).path, "RouteCache kept a route of the previous map"
+        assert path_cost(map_40, path) is not None, "Route {} uses a road which does not exist".format(path)
+        assert abs(cost - shortest_cost(map_40, start, goal)) < 1e-9, "Route {} is not a shortest one".format(path)
+    assert routes.cache_info().invalidations == 1, "RouteCache was not invalidated by the map change"
+    assert planner_class(map_40, 5, 34).path != MAP_40_ANSWERS[0][2], "The removed road is still used"
+    print("Map change tests pass!")
+
+def test_map_files(planner_class):
+    """Maps read back from Map.save and from the binary format give the same routes"""
+    map_40 = load_map_40()
+    csr = map_40.to_csr()
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_file, binary_file = os.path.join(directory, "map_40.pickle"), os.path.join(directory, "map_40.bin")
+        map_40.save(pickle_file)
+        map_40.save_binary(binary_file)
+        loaded_maps = [Map.load(pickle_file), CSRGraph.load(binary_file, mmap=False), CSRGraph.load(binary_file, mmap=True)]
+        for loaded in loaded_maps[1:]:
+            for name in ("offsets", "neighbors", "weights", "coords"):
+                assert np.array_equal(getattr(loaded, name), getattr(csr, name)), "Binary map {} differ".format(name)
+        loaded_maps.append(loaded_maps[-1].to_map())
+        for loaded in loaded_maps:
+            for start, goal, answer_path in MAP_40_ANSWERS:
+                path = planner_class(loaded, start, goal).path
+                assert path == answer_path, "Path {} on a loaded map differs from the answer".format(path)
+                assert math.isclose(path_cost(loaded, path), path_cost(map_40, path)), "Path costs differ on a loaded map"
+        try:
+            Map.load(binary_file)
+            assert False, "Map.load read a binary map file"
+        except ValueError:
+            pass
+        del loaded_maps, loaded
+    print("Map file tests pass!")
+
+# The tests of the planner extensions (open set, map formats, caches, precomputed heuristics and indices)
+EXTENSION_TESTS = [test_open_set, test_csr, test_search_state, test_plan_many, test_route_cache, test_bidirectional,
+                   test_landmarks, test_contraction, test_spatial_index, test_shortest_path_tree, test_map_changes,
+                   test_map_files]
+
+def test_extensions(planner_class):
+    """Runs all the EXTENSION_TESTS, each raises an AssertionError on failure"""
+    for extension_test in EXTENSION_TESTS:
+        extension_test(planner_class)
+    print("All extension tests pass!")
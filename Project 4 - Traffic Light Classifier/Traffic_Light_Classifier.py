@@ -1,5 +1,6 @@
 import cv2 
 import helpers 
+import region_features
 
 import random
 import numpy as np
@@ -15,9 +16,13 @@ import matplotlib.image as mpimg
 IMAGE_DIR_TRAINING = "traffic_light_images/training/"
 IMAGE_DIR_TEST = "traffic_light_images/test/"
 
-# Using the load_dataset function in helpers.py
-# Load training data
-IMAGE_LIST = helpers.load_dataset(IMAGE_DIR_TRAINING)
+# Standardized images cache directories
+CACHE_DIR_TRAINING = "standardized_cache/training/"
+CACHE_DIR_TEST = "standardized_cache/test/"
+
+# Using the ImageDataset class in helpers.py
+# List the training data, an image is only read when it is accessed
+IMAGE_LIST = helpers.ImageDataset(IMAGE_DIR_TRAINING)
 
 
 # Visualize the Data
@@ -37,6 +42,12 @@ print ("Label: ",selected_label)
 ##2.Pre-Processing###
 #####################
 
+#Crop portions and size of the standardized images (the standardized images cache depends on them)
+PORTION_X = 0.3
+PORTION_Y = 0.15
+STANDARD_SIZE = 32
+STANDARD_PARAMS = {'portion_x': PORTION_X, 'portion_y': PORTION_Y, 'size': STANDARD_SIZE}
+
 # This function should take in an RGB image and return a new, standardized version
 def standardize_input(image):
     
@@ -47,8 +58,8 @@ def standardize_input(image):
     #Crop the image to cut out all irrelevant pixels
     #cut off 30% of the image from each side
     #cut off 15% of the image from top and bottom
-    portion_x =0.3 
-    portion_y =0.15 
+    portion_x = PORTION_X
+    portion_y = PORTION_Y
     
     
     x1 = int(portion_x*image.shape[1])
@@ -62,7 +73,7 @@ def standardize_input(image):
     
     
     #Resize the image to the standard size (32x32)
-    standard_im = cv2.resize(standard_im,(32,32))
+    standard_im = cv2.resize(standard_im,(STANDARD_SIZE,STANDARD_SIZE))
     
     
     return standard_im
@@ -114,8 +125,14 @@ def standardize(image_list):
         
     return standard_list
 
+# Same list as standardize, built from the standardized images cached in cache_dir
+# Only the images added or changed since the last run are read and standardized again
+def standardize_cached(image_dir, cache_dir):
+    images, labels = helpers.load_standardized_dataset(image_dir, cache_dir, standardize_input, STANDARD_PARAMS)
+    return [(image, one_hot_encode(label)) for image, label in zip(images, labels)]
+
 # Standardize all training images
-STANDARDIZED_LIST = standardize(IMAGE_LIST)
+STANDARDIZED_LIST = standardize_cached(IMAGE_DIR_TRAINING, CACHE_DIR_TRAINING)
 
 #Visualize the Standardized data
 im_num = 900
@@ -161,6 +178,9 @@ ax3.imshow(s, cmap='gray')
 ax4.set_title('V channel')
 ax4.imshow(v, cmap='gray')
 
+#Rows of the v channel averaged by create_feature for the red, yellow and green regions
+FEATURE_REGIONS = [(5, 9), (13, 18), (24, 32)]
+
 #Create features
 ## This feature should use HSV colorspace values
 def create_feature(rgb_image):
@@ -172,24 +192,32 @@ def create_feature(rgb_image):
     v = hsv[:,:,2]
 
     #The image is divided into 3 regions in height for each of the color (To determine the average v values) of the pixels
-    #the red region is from height = 5 to 9 , yellow from 13 to 18 , and green from 24 to 32
-    
+    #the red, yellow and green regions are the rows of FEATURE_REGIONS
     
-    #Slicing the image in width for the seperated regions
-    r_region = v[5:9,:]
-    y_region = v[13:18,:]
-    g_region = v[24:32,:]
     
-    #Compute the average v value over each region 
-    r_region = np.sum(r_region) /(r_region.shape[0]*r_region.shape[1])
-    y_region = np.sum(y_region)/(y_region.shape[0]*y_region.shape[1])
-    g_region = np.sum(g_region)/(g_region.shape[0]*g_region.shape[1])
-    
-    
-    feature = [r_region,y_region,g_region]
+    #Slicing the image in width for the seperated regions, then compute the average v value over each region
+    feature = []
+    for y1, y2 in FEATURE_REGIONS:
+        region = v[y1:y2,:]
+        feature.append(np.sum(region)/(region.shape[0]*region.shape[1]))
     
     return feature
 
+#Same features as create_feature for a whole (N, 32, 32, 3) array of rgb images, returns an (N, 3) array
+def create_features_batch(rgb_images):
+
+    rgb_images = np.asarray(rgb_images)
+
+    #The v channel of the HSV colorspace is the largest of the r, g and b values
+    v = np.maximum(np.maximum(rgb_images[..., 0], rgb_images[..., 1]), rgb_images[..., 2])
+
+    #Sum of each row of every image, then average v value over each region
+    row_sums = v.sum(axis=2, dtype=np.float64)
+    width = v.shape[2]
+    features = [row_sums[:, y1:y2].sum(axis=1) / ((y2 - y1) * width) for y1, y2 in FEATURE_REGIONS]
+
+    return np.stack(features, axis=1)
+
 
 #####################
 ##4.Classification###
@@ -228,17 +256,27 @@ def estimate_label(rgb_image):
     return one_hot_encode('red')
 
 
+#Same decision rule as estimate_label for a whole (N, 32, 32, 3) array of rgb images
+#Returns an (N, 3) array of one-hot encoded labels
+def estimate_labels_batch(rgb_images):
+
+    #Classes 0 red, 1 yellow, 2 green, the rows of the identity matrix are their one-hot labels
+    classes = region_features.decide_labels(create_features_batch(rgb_images))
+
+    return np.eye(3, dtype=int)[classes]
+
+
 
 #############################
 ##4.Testing the Classifier###
 #############################
 
-# Using the load_dataset function in helpers.py
-# Load test data
-TEST_IMAGE_LIST = helpers.load_dataset(IMAGE_DIR_TEST)
+# Using the ImageDataset class in helpers.py
+# List the test data
+TEST_IMAGE_LIST = helpers.ImageDataset(IMAGE_DIR_TEST)
 
 # Standardize the test data
-STANDARDIZED_TEST_LIST = standardize(TEST_IMAGE_LIST)
+STANDARDIZED_TEST_LIST = standardize_cached(IMAGE_DIR_TEST, CACHE_DIR_TEST)
 
 # Shuffle the standardized test data
 random.shuffle(STANDARDIZED_TEST_LIST)
@@ -252,9 +290,12 @@ def get_misclassified_images(test_images):
     # Track misclassified images by placing them into a list
     misclassified_images_labels = []
 
+    # Classify all the test images at once
+    predicted_labels = estimate_labels_batch([image[0] for image in test_images]).tolist() if len(test_images) else []
+
     # Iterate through all the test images
-    # Classify each image and compare to the true label
-    for image in test_images:
+    # Compare each predicted label to the true label
+    for image, predicted_label in zip(test_images, predicted_labels):
 
         # Get true data
         im = image[0]
@@ -262,7 +303,6 @@ def get_misclassified_images(test_images):
         assert(len(true_label) == 3), "The true_label is not the expected length (3)."
 
         # Get predicted label from your classifier
-        predicted_label = estimate_label(im)
         assert(len(predicted_label) == 3), "The predicted_label is not the expected length (3)."
 
         # Compare true and predicted labels 
@@ -304,4 +344,16 @@ if(len(MISCLASSIFIED) > 0):
     # Test code for one_hot_encode function
     tests.test_red_as_green(MISCLASSIFIED)
 else:
-    print("MISCLASSIFIED may not have been populated with images.")
\ No newline at end of file
+    print("MISCLASSIFIED may not have been populated with images.")
+
+
+#############################################
+###Tests of the dataset and batch helpers####
+#############################################
+tests.test_image_dataset(IMAGE_DIR_TEST)
+tests.test_standardized_cache(IMAGE_DIR_TEST, standardize_input, STANDARD_PARAMS)
+tests.test_batch_functions(create_feature, create_features_batch, estimate_label, estimate_labels_batch,
+                           [image[0] for image in STANDARDIZED_TEST_LIST])
+tests.test_drop_oldest_queue()
+tests.test_streaming_classifier(IMAGE_DIR_TEST, standardize_input, estimate_label, estimate_labels_batch)
+tests.test_region_means(create_feature, FEATURE_REGIONS, [image[0] for image in STANDARDIZED_TEST_LIST])
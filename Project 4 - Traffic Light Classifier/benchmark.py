@@ -0,0 +1,123 @@
+#Benchmarks of the traffic light classifier pipeline
+#Usage: python benchmark.py [--image-dir traffic_light_images/training/]
+
+import argparse
+import time
+
+import numpy as np
+
+import helpers
+import region_features
+import streaming
+
+IMAGE_DIR_TRAINING = "traffic_light_images/training/"
+
+#Compares decoding a dataset with 1 worker (sequential, like the previous load_dataset) and with pools of workers
+def benchmark_loading(image_dir=IMAGE_DIR_TRAINING, workers=(1, 2, 4, 8), use_processes=False, chunk_size=helpers.CHUNK_SIZE):
+    print("{:>8} {:>12} {:>12}".format("workers", "time (s)", "images/s"))
+    results = []
+    for n_workers in workers:
+        dataset = helpers.ImageDataset(image_dir, workers=n_workers, use_processes=use_processes)
+        begin = time.perf_counter()
+        n_images = sum(len(chunk) for chunk in dataset.iter_chunks(chunk_size))
+        elapsed = time.perf_counter() - begin
+        results.append((n_workers, elapsed, n_images / elapsed))
+        print("{:>8} {:>12.3f} {:>12.1f}".format(*results[-1]))
+    return results
+
+
+#Compares classifying an (N, 32, 32, 3) array of standardized images one at a time with estimate_label
+#and at once with estimate_labels_batch (both from Traffic_Light_Classifier), repeat times each
+def benchmark_classification(images, estimate_label, estimate_labels_batch, repeat=5):
+    images = np.asarray(images)
+    print("{:>8} {:>12} {:>12}".format("method", "time (s)", "images/s"))
+    results = []
+    for name, classify in (("loop", lambda: [estimate_label(im) for im in images]),
+                           ("batch", lambda: estimate_labels_batch(images))):
+        begin = time.perf_counter()
+        for i in range(repeat):
+            classify()
+        elapsed = (time.perf_counter() - begin) / repeat
+        results.append((name, elapsed, len(images) / elapsed))
+        print("{:>8} {:>12.4f} {:>12.1f}".format(*results[-1]))
+    return results
+
+
+#Streams the images of image_dir through a StreamingClassifier at each frame rate (None for as fast as possible)
+#and reports the drops, the latency percentiles and the accuracy of the frames that were classified
+def benchmark_streaming(image_dir, standardize_input, estimate_labels_batch, one_hot_encode, fps=(30, 300, 3000, None),
+                        n_frames=1000, batch_size=streaming.BATCH_SIZE, queue_size=streaming.QUEUE_SIZE):
+    print("{:>8} {:>10} {:>8} {:>10} {:>10} {:>10} {:>10}".format("fps", "classified", "dropped", "p50 (ms)", "p90 (ms)",
+                                                                  "p99 (ms)", "accuracy"))
+    results = []
+    for rate in fps:
+        true_labels = {}
+        correct = []
+        on_label = lambda frame_id, label, latency: correct.append(label == true_labels[frame_id])
+        classifier = streaming.StreamingClassifier(standardize_input, estimate_labels_batch, queue_size=queue_size,
+                                                   batch_size=batch_size, callback=on_label)
+        with classifier:
+            for frame_id, frame, label in streaming.synthetic_frames(image_dir, rate, n_frames):
+                true_labels[frame_id] = one_hot_encode(label)
+                classifier.submit(frame, frame_id)
+        stats = classifier.stats()
+        results.append((rate, stats, sum(correct) / len(correct)))
+        print("{:>8} {:>10} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.4f}".format(
+            str(rate), stats['classified'], stats['dropped'], stats['p50_ms'], stats['p90_ms'], stats['p99_ms'], results[-1][2]))
+    return results
+
+
+#Scores every layout of three row bands (boundaries on multiples of step) on the standardized images with
+#summed-area tables, compared to the time the per-image np.sum of create_feature would take for the same layouts
+#labels are the one-hot labels of the images. Prints the best layouts
+def benchmark_region_layouts(images, labels, step=2, columns=None, best=5):
+    images = np.asarray(images)
+    classes = np.argmax(labels, axis=1)
+
+    begin = time.perf_counter()
+    tables = region_features.summed_area_tables(images)
+    bands, layouts = region_features.stacked_layouts(images.shape[1], step, columns)
+    accuracy = region_features.score_layouts(tables, bands, layouts, classes)
+    elapsed = time.perf_counter() - begin
+
+    #Slicing and summing the v channel of every image for a sample of the layouts
+    v = images.max(axis=3)
+    sample = layouts[:20]
+    begin = time.perf_counter()
+    for layout in sample:
+        for image_v in v:
+            [np.sum(image_v[y1:y2, x1:x2]) / ((y2 - y1) * (x2 - x1)) for y1, y2, x1, x2 in bands[layout]]
+    direct = (time.perf_counter() - begin) / len(sample) * len(layouts)
+
+    print("{} layouts on {} images: {:.3f} s with summed-area tables, about {:.1f} s with np.sum per image".format(
+        len(layouts), len(images), elapsed, direct))
+    order = np.argsort(-accuracy, kind='stable')[:best]
+    for i in order:
+        print("{:.4f}  red {}  yellow {}  green {}".format(accuracy[i], *[tuple(band[:2]) for band in bands[layouts[i]].tolist()]))
+    return accuracy, bands, layouts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the traffic light classifier pipeline')
+    parser.add_argument('--image-dir', default=IMAGE_DIR_TRAINING)
+    parser.add_argument('--processes', action='store_true', help='decode with processes instead of threads')
+    parser.add_argument('--classification', action='store_true', help='benchmark the classification instead of the loading')
+    parser.add_argument('--streaming', action='store_true', help='benchmark the streaming classifier instead of the loading')
+    parser.add_argument('--layouts', action='store_true', help='score the region layouts instead of benchmarking the loading')
+    args = parser.parse_args()
+
+    if args.layouts:
+        import Traffic_Light_Classifier as classifier
+        benchmark_region_layouts([im for im, label in classifier.STANDARDIZED_LIST],
+                                 [label for im, label in classifier.STANDARDIZED_LIST])
+    elif args.streaming:
+        import Traffic_Light_Classifier as classifier
+        benchmark_streaming(args.image_dir, classifier.standardize_input, classifier.estimate_labels_batch,
+                            classifier.one_hot_encode)
+    elif args.classification:
+        #Importing the classifier runs it on the whole dataset once
+        import Traffic_Light_Classifier as classifier
+        images = [im for im, label in classifier.STANDARDIZED_LIST]
+        benchmark_classification(images, classifier.estimate_label, classifier.estimate_labels_batch)
+    else:
+        benchmark_loading(args.image_dir, use_processes=args.processes)
@@ -2,34 +2,192 @@
 
 import os
 import glob # library for loading images from a directory
+import concurrent.futures
+import json
+import uuid
 import matplotlib.image as mpimg
+import numpy as np
 
 
+# The color folders of a dataset, in the order they are loaded
+IMAGE_TYPES = ["red", "yellow", "green"]
+
+# Number of images decoded together by ImageDataset.iter_chunks
+CHUNK_SIZE = 256
+
 
 # This function loads in images and their labels and places them in a list
 # The list contains all images and their associated labels
 # For example, after data is loaded, im_list[0][:] will be the first image-label pair in the list
 def load_dataset(image_dir):
-    
-    # Populate this empty image list
-    im_list = []
-    image_types = ["red", "yellow", "green"]
-    
-    # Iterate through each color folder
-    for im_type in image_types:
-        
-        # Iterate through each image file in each image_type folder
-        # glob reads in any image with the extension "image_dir/im_type/*"
-        for file in glob.glob(os.path.join(image_dir, im_type, "*")):
-            
-            # Read in the image
-            im = mpimg.imread(file)
-            
-            # Check if the image exists/if it's been correctly read-in
-            if not im is None:
-                # Append the image, and it's type (red, green, yellow) to the image list
-                im_list.append((im, im_type))
-
-    return im_list
 
+    # The images are decoded in parallel, in the same order as a sequential load
+    return ImageDataset(image_dir).load()
+
+
+# Reads one image, raises ValueError naming the file when it cannot be read (missing, unreadable or not an image)
+def _read_image(file):
+    try:
+        return mpimg.imread(file)
+    except (OSError, ValueError) as e:
+        raise ValueError("Could not read the image " + file + ": " + str(e)) from e
+
+
+# A dataset of (image, label) pairs stored under image_dir/<label>/*
+# The file list is built up front, the images are only decoded when they are accessed:
+#   dataset[i]                  decodes one image
+#   dataset.iter_chunks(n)      yields lists of n pairs, decoded in parallel while the previous list is used
+#   dataset.load()              decodes everything into a list, like load_dataset
+# workers: number of threads (or processes with use_processes=True) decoding the images, None for the default
+# A file that cannot be read raises ValueError, from dataset[i] as from the iteration and load, so every
+# one of the len(dataset) files gives a pair
+class ImageDataset(object):
+
+    def __init__(self, image_dir, image_types=IMAGE_TYPES, workers=None, use_processes=False):
+        self.image_dir = image_dir
+        self.workers = workers
+        self.use_processes = use_processes
+
+        # (file, label) of every image, in the order of load_dataset
+        self.files = []
+        for im_type in image_types:
+            for file in glob.glob(os.path.join(image_dir, im_type, "*")):
+                self.files.append((file, im_type))
+
+    def __len__(self):
+        return len(self.files)
+
+    # A dataset of the images at the given indices, with the same workers
+    def subset(self, indices):
+        dataset = ImageDataset.__new__(ImageDataset)
+        dataset.image_dir = self.image_dir
+        dataset.workers = self.workers
+        dataset.use_processes = self.use_processes
+        dataset.files = [self.files[i] for i in indices]
+        return dataset
+
+    # Decodes the image at index i, returns (image, label)
+    def __getitem__(self, i):
+        file, label = self.files[i]
+        return (_read_image(file), label)
+
+    def __iter__(self):
+        for chunk in self.iter_chunks():
+            for item in chunk:
+                yield item
+
+    def _executor(self):
+        if self.workers == 1:
+            return None
+        if self.use_processes:
+            return concurrent.futures.ProcessPoolExecutor(self.workers)
+        return concurrent.futures.ThreadPoolExecutor(self.workers)
+
+    # Yields the dataset as lists of up to chunk_size (image, label) pairs
+    # Only the current chunk and the one being decoded are held in memory
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        starts = range(0, len(self.files), chunk_size)
+        executor = self._executor()
+
+        if executor is None:
+            for start in starts:
+                files = self.files[start:start + chunk_size]
+                yield self._pairs(files, (_read_image(file) for file, label in files))
+            return
+
+        with executor:
+            pending = None
+            for start in starts:
+                files = self.files[start:start + chunk_size]
+                # Submit the next chunk before handing out the current one
+                submitted = (files, [executor.submit(_read_image, file) for file, label in files])
+                if pending is not None:
+                    yield self._pairs(pending[0], (future.result() for future in pending[1]))
+                pending = submitted
+            if pending is not None:
+                yield self._pairs(pending[0], (future.result() for future in pending[1]))
+
+    # Pairs the decoded images with their labels
+    def _pairs(self, files, images):
+        return [(im, label) for (file, label), im in zip(files, images)]
+
+    # Decodes the whole dataset, returns the list of (image, label) pairs
+    def load(self, chunk_size=CHUNK_SIZE):
+        im_list = []
+        for chunk in self.iter_chunks(chunk_size):
+            im_list.extend(chunk)
+        return im_list
+
+
+# Cache of the standardized images of a dataset, written in cache_dir as:
+#   images-<id>.npy   (N, 32, 32, 3) array of the standardized images, memory mapped when it is read
+#   index.json        the parameters of the standardization, the name of the images file and the path
+#                     (relative to image_dir), mtime and size of every source file
+# The rows follow the order of load_dataset. standardize_function turns one image into its standardized
+# version, params are the values it depends on (e.g. the crop portions): the cache is rebuilt when they
+# change, otherwise only the files added or modified since it was written are decoded and standardized
+# A new images file never overwrites the one of the index, the index is replaced once it is complete:
+# a run stopped at any point leaves the previous index and images, which still match
+# The labels come from the folder names, they are not cached. Returns the (images, labels) arrays
+def load_standardized_dataset(image_dir, cache_dir, standardize_function, params, workers=None):
+    dataset = ImageDataset(image_dir, workers=workers)
+    sources = [_file_signature(file, image_dir) for file, label in dataset.files]
+    labels = np.array([label for file, label in dataset.files])
+
+    index_file = os.path.join(cache_dir, "index.json")
+    cached = None
+    cached_rows = {}
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+        images_file = os.path.join(cache_dir, index.get("images", ""))
+        if index["params"] == params and os.path.isfile(images_file):
+            cached = np.load(images_file, mmap_mode='r')
+            # An images file without one row per source does not belong to this index, it is not used
+            if len(cached) == len(index["sources"]):
+                cached_rows = {tuple(source): row for row, source in enumerate(index["sources"])}
+
+    rows = [cached_rows.get(source) for source in sources]
+    if len(rows) == len(cached_rows) and rows == list(range(len(rows))):
+        # Nothing changed
+        return cached, labels
+
+    changed = [i for i, row in enumerate(rows) if row is None]
+    standardized = {}
+    for start in range(0, len(changed), CHUNK_SIZE):
+        indices = changed[start:start + CHUNK_SIZE]
+        images = [im for im, label in dataset.subset(indices).load()]
+        for i, im in zip(indices, images):
+            standardized[i] = standardize_function(im)
+
+    # Shape and dtype of a standardized image
+    sample = cached[0] if cached_rows and len(cached) else next(iter(standardized.values()), None)
+    shape, dtype = (sample.shape, sample.dtype) if sample is not None else ((32, 32, 3), np.uint8)
+    os.makedirs(cache_dir, exist_ok=True)
+    images_name = "images-" + uuid.uuid4().hex + ".npy"
+    images = np.lib.format.open_memmap(os.path.join(cache_dir, images_name), mode='w+', dtype=dtype,
+                                       shape=(len(rows),) + shape)
+    for i, row in enumerate(rows):
+        images[i] = cached[row] if row is not None else standardized[i]
+    images.flush()
+    del images, cached, sample
+
+    with open(index_file + ".new", "w") as f:
+        json.dump({"params": params, "images": images_name, "sources": sources}, f)
+    os.replace(index_file + ".new", index_file)
+
+    # The images files of the previous runs are not referenced anymore
+    for file in glob.glob(os.path.join(cache_dir, "images*.npy")):
+        if os.path.basename(file) != images_name:
+            try:
+                os.remove(file)
+            except OSError:
+                # Still memory mapped by a reader on a system which does not allow removing it
+                pass
+    return np.load(os.path.join(cache_dir, images_name), mmap_mode='r'), labels
 
+# (path relative to image_dir, modification time, size) of a file, a file is processed again when any of
+# them changes. The relative path keeps the cache valid whatever the working directory
+def _file_signature(file, image_dir):
+    stat = os.stat(file)
+    return (os.path.relpath(file, image_dir), stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,101 @@
+# Brightness features of arbitrary rectangular regions, to explore other layouts than the fixed bands of create_feature
+# The summed-area table of a channel is computed once per image, after that the mean of any rectangle costs
+# four lookups, whatever its size. A region is (y1, y2, x1, x2): rows y1 to y2 - 1 and columns x1 to x2 - 1
+#
+#   tables = summed_area_tables(images, channels=('v', 's'))      # (N, 32, 32, 3) standardized images
+#   means = region_means(tables, [(5, 9, 0, 32), (13, 18, 0, 32), (24, 32, 0, 32)])   # create_feature's regions
+#   bands, layouts = stacked_layouts(32, step=2, columns=(8, 24))
+#   accuracy = score_layouts(tables, bands, layouts, labels)      # one value per candidate layout
+
+import itertools
+
+import cv2
+import numpy as np
+
+# Index of each channel in the HSV images
+CHANNELS = {'h': 0, 's': 1, 'v': 2}
+
+# Layouts scored together by score_layouts, bounds the memory used by their features
+LAYOUT_CHUNK = 1024
+
+
+# Summed-area tables of the HSV channels of an (N, H, W, 3) array of rgb images (or of one (H, W, 3) image)
+# Returns an (N, C, H + 1, W + 1) array, tables[n, c, y, x] is the sum of channel c of image n over the rows
+# before y and the columns before x. The sums are exact integers for uint8 images
+def summed_area_tables(rgb_images, channels=('v',)):
+    rgb_images = np.asarray(rgb_images)
+    if rgb_images.ndim == 3:
+        rgb_images = rgb_images[np.newaxis]
+    n, h, w = rgb_images.shape[:3]
+
+    dtype = np.int64 if np.issubdtype(rgb_images.dtype, np.integer) else np.float64
+    tables = np.zeros((n, len(channels), h + 1, w + 1), dtype=dtype)
+    if n == 0:
+        return tables
+
+    # The conversion works pixel by pixel, so all the images are converted at once as one tall image
+    hsv = cv2.cvtColor(np.ascontiguousarray(rgb_images).reshape(n * h, w, 3), cv2.COLOR_RGB2HSV).reshape(n, h, w, 3)
+    for c, channel in enumerate(channels):
+        np.cumsum(np.cumsum(hsv[..., CHANNELS[channel]], axis=1, dtype=dtype), axis=2, out=tables[:, c, 1:, 1:])
+    return tables
+
+
+# Mean of channel number c of the tables over each region of an (R, 4) list of regions
+# Returns an (N, R) array
+def region_means(tables, regions, c=0):
+    regions = np.asarray(regions, dtype=np.intp).reshape(-1, 4)
+    y1, y2, x1, x2 = regions.T
+    h, w = tables.shape[2] - 1, tables.shape[3] - 1
+    if np.any((y1 < 0) | (y2 <= y1) | (y2 > h) | (x1 < 0) | (x2 <= x1) | (x2 > w)):
+        raise ValueError("Regions must be non-empty and within the " + str(h) + "x" + str(w) + " images")
+
+    table = tables[:, c]
+    sums = table[:, y2, x2] - table[:, y1, x2] - table[:, y2, x1] + table[:, y1, x1]
+    return sums / ((y2 - y1) * (x2 - x1))
+
+
+# Candidate layouts of three row bands over the columns [x1, x2) (all of them by default): red above yellow
+# above green, without overlap. The band boundaries are the multiples of step below height, and height
+# Returns (bands, layouts): the (B, 4) regions of all the bands and the (L, 3) indices of the
+# red, yellow and green bands of each layout, so the mean of every band is only computed once
+def stacked_layouts(height, step=1, columns=None):
+    x1, x2 = columns if columns is not None else (0, height)
+    boundaries = list(range(0, height, step)) + [height]
+
+    band_index = {}
+    for y1, y2 in itertools.combinations(boundaries, 2):
+        band_index[(y1, y2)] = len(band_index)
+    bands = np.array([(y1, y2, x1, x2) for y1, y2 in band_index], dtype=np.intp).reshape(-1, 4)
+
+    # Bands may touch (the end of one band is the start of the next one)
+    layouts = [(band_index[(b0, b1)], band_index[(b2, b3)], band_index[(b4, b5)])
+               for b0, b1, b2, b3, b4, b5 in itertools.combinations_with_replacement(boundaries, 6)
+               if b0 < b1 and b2 < b3 and b4 < b5]
+    return bands, np.array(layouts, dtype=np.intp).reshape(-1, 3)
+
+
+# Classes (0 red, 1 yellow, 2 green) given by the estimate_label rule to an (..., 3) array of red, yellow
+# and green region means
+def decide_labels(features):
+    r_region = features[..., 0]
+    y_region = features[..., 1]
+    g_region = features[..., 2]
+
+    # Yellow region detected, otherwise green when it is above red, red in any other case
+    yellow = (y_region > r_region) & (y_region > g_region)
+    green = ~yellow & (g_region > r_region)
+    return np.where(yellow, 1, np.where(green, 2, 0))
+
+
+# Accuracy of the estimate_label rule with every layout, given the (N,) classes of the images
+# (0 red, 1 yellow, 2 green). Returns an (L,) array
+def score_layouts(tables, bands, layouts, labels, c=0):
+    means = region_means(tables, bands, c)
+    labels = np.asarray(labels)[:, np.newaxis]
+    accuracy = np.empty(len(layouts))
+    for start in range(0, len(layouts), LAYOUT_CHUNK):
+        chunk = layouts[start:start + LAYOUT_CHUNK]
+        # (N, chunk, 3) features of the images with each layout
+        predicted = decide_labels(means[:, chunk])
+        accuracy[start:start + len(chunk)] = (predicted == labels).mean(axis=0)
+    return accuracy
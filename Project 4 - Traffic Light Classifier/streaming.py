@@ -0,0 +1,173 @@
+# Real-time classification of traffic light crops coming from a camera
+# A producer (the camera) submits frames to a bounded queue, a consumer thread takes them in micro batches,
+# standardizes them and classifies the whole batch at once. When the consumer falls behind, the queue drops
+# the oldest frames: a late label is worth less than a fresh one
+#
+#   classifier = StreamingClassifier(standardize_input, estimate_labels_batch, callback=on_label)
+#   with classifier:
+#       for frame_id, frame, label in synthetic_frames("traffic_light_images/test/", fps=30, n_frames=300):
+#           classifier.submit(frame, frame_id)
+#   print(classifier.stats())
+
+import collections
+import threading
+import time
+
+import numpy as np
+
+import helpers
+
+# Frames waiting to be classified, the oldest ones are dropped beyond that
+QUEUE_SIZE = 32
+# Most frames classified together
+BATCH_SIZE = 8
+# Seconds the consumer waits for a batch to fill up once it has a frame
+BATCH_TIMEOUT = 0.002
+# Number of latest latencies kept for the percentiles
+LATENCY_WINDOW = 10000
+
+
+# Bounded FIFO shared by a producer and a consumer thread, putting an item in a full queue drops the oldest one
+class DropOldestQueue(object):
+
+    def __init__(self, maxsize=QUEUE_SIZE):
+        self.items = collections.deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        with self.condition:
+            if self.closed:
+                raise ValueError("put on a closed queue")
+            if len(self.items) == self.items.maxlen:
+                # The deque drops the oldest item itself
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    # Waits for an item, then for up to timeout seconds for the batch to fill up to max_items
+    # Returns the batch, oldest first, or [] once the queue is closed and empty
+    def get_batch(self, max_items, timeout=0):
+        with self.condition:
+            while not self.items and not self.closed:
+                self.condition.wait()
+            deadline = time.perf_counter() + timeout
+            while len(self.items) < max_items and not self.closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return [self.items.popleft() for i in range(min(max_items, len(self.items)))]
+
+    # No more items will be put, the consumer gets the remaining ones then []
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+# Classifies frames submitted from a producer thread on a consumer thread
+# standardize_function turns one frame into a standardized image (e.g. standardize_input)
+# estimate_labels_function turns an (N, 32, 32, 3) array of them into (N, 3) one-hot labels (e.g. estimate_labels_batch)
+# callback(frame_id, label, latency) is called on the consumer thread for every classified frame,
+# latency is the time in seconds between submit and the label
+class StreamingClassifier(object):
+
+    def __init__(self, standardize_function, estimate_labels_function, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 batch_timeout=BATCH_TIMEOUT, callback=None):
+        self.standardize_function = standardize_function
+        self.estimate_labels_function = estimate_labels_function
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.callback = callback
+        self.queue = DropOldestQueue(queue_size)
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.submitted = 0
+        self.classified = 0
+        self.batches = 0
+        self.error = None
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Classifies the frames still queued and waits for the consumer thread
+    # Raises the error that stopped the consumer, if any
+    def stop(self):
+        self.queue.close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
+
+    # Queues a frame, returns immediately. frame_id defaults to the number of frames submitted before
+    def submit(self, frame, frame_id=None):
+        if frame_id is None:
+            frame_id = self.submitted
+        self.submitted += 1
+        self.queue.put((frame_id, frame, time.perf_counter()))
+
+    def _run(self):
+        try:
+            while True:
+                batch = self.queue.get_batch(self.batch_size, self.batch_timeout)
+                if not batch:
+                    return
+                images = np.stack([self.standardize_function(frame) for frame_id, frame, submitted in batch])
+                labels = np.asarray(self.estimate_labels_function(images)).tolist()
+                done = time.perf_counter()
+                self.batches += 1
+                for (frame_id, frame, submitted), label in zip(batch, labels):
+                    self.latencies.append(done - submitted)
+                    self.classified += 1
+                    if self.callback is not None:
+                        self.callback(frame_id, label, done - submitted)
+        except Exception as e:
+            # Stop taking frames, stop() raises the error on the producer side
+            self.error = e
+            self.queue.close()
+
+    # Counts of frames and latency percentiles in milliseconds over the latest LATENCY_WINDOW frames
+    def stats(self, percentiles=(50, 90, 99)):
+        latencies = np.array(self.latencies) * 1000
+        stats = {'submitted': self.submitted, 'classified': self.classified, 'dropped': self.queue.dropped,
+                 'batches': self.batches}
+        for p in percentiles:
+            stats['p' + str(p) + '_ms'] = float(np.percentile(latencies, p)) if len(latencies) else float('nan')
+        stats['max_ms'] = float(latencies.max()) if len(latencies) else float('nan')
+        return stats
+
+
+# Synthetic camera feed made of the images of a dataset folder
+# Yields n_frames (frame_id, image, label), cycling through the images in a random order (all of them once by default)
+# A frame is yielded every 1 / fps seconds, as fast as possible with fps=None
+# The images are decoded up front so the decoding does not slow the feed down
+def synthetic_frames(image_dir, fps=30, n_frames=None, seed=0):
+    im_list = helpers.load_dataset(image_dir)
+    if not im_list:
+        return
+    if n_frames is None:
+        n_frames = len(im_list)
+    order = np.random.default_rng(seed).permutation(len(im_list)).tolist()
+
+    begin = time.perf_counter()
+    for frame_id in range(n_frames):
+        if fps:
+            delay = begin + frame_id / fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        image, label = im_list[order[frame_id % len(order)]]
+        yield frame_id, image, label
@@ -1,7 +1,19 @@
 # All test code
+import glob
+import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 from IPython.display import Markdown, display
 
+import numpy as np
+
+import helpers
+import region_features
+import streaming
+
 
 
 # Helper functions for printing markdown text (text in color/bold/etc)
@@ -66,9 +78,234 @@ class Tests(unittest.TestCase):
         print_pass()
 
 
+    # Tests that ImageDataset loads the images of image_dir in the order of a sequential load, whatever
+    # the workers and chunks, and raises ValueError on a file that cannot be read
+    def test_image_dataset(self, image_dir):
+        try:
+            sequential = helpers.ImageDataset(image_dir, workers=1).load()
+            self.assertGreater(len(sequential), 0)
+            for dataset in (helpers.ImageDataset(image_dir), helpers.ImageDataset(image_dir, workers=3)):
+                loaded = [item for chunk in dataset.iter_chunks(50) for item in chunk]
+                self.assertEqual([label for im, label in sequential], [label for im, label in loaded])
+                self.assertTrue(all(np.array_equal(a, b) for (a, _), (b, _) in zip(sequential, loaded)))
+            self.assertTrue(np.array_equal(sequential[-1][0], helpers.ImageDataset(image_dir)[len(sequential) - 1][0]))
 
+            # A copy of one image per color, and a file that is not an image
+            with tempfile.TemporaryDirectory() as copy_dir:
+                for im_type in helpers.IMAGE_TYPES:
+                    os.makedirs(os.path.join(copy_dir, im_type))
+                    file = sorted(glob.glob(os.path.join(image_dir, im_type, "*")))[0]
+                    shutil.copy(file, os.path.join(copy_dir, im_type))
+                with open(os.path.join(copy_dir, "red", "broken.jpg"), "w") as f:
+                    f.write("not an image")
+                dataset = helpers.ImageDataset(copy_dir)
+                self.assertEqual(4, len(dataset))
+                broken = [file for file, label in dataset.files].index(os.path.join(copy_dir, "red", "broken.jpg"))
+                self.assertRaises(ValueError, dataset.__getitem__, broken)
+                self.assertRaises(ValueError, dataset.load)
+                self.assertRaises(ValueError, helpers.ImageDataset(copy_dir, workers=1).load)
+                self.assertRaises(ValueError, helpers.load_standardized_dataset, copy_dir, os.path.join(copy_dir, "cache"),
+                                  lambda im: im, {})
+                self.assertEqual(["red", "yellow", "green"], [label for im, label in dataset.subset([1 - broken, 2, 3])])
 
+        except self.failureException as e:
+            print_fail()
+            print("ImageDataset did not load the expected images.")
+            print('\n'+str(e))
+            return
 
+        print_pass()
 
 
+    # Tests that load_standardized_dataset standardizes each image once, and again only when params
+    # change or when the file is modified, and that a run stopped while writing leaves a usable cache
+    def test_standardized_cache(self, image_dir, standardize_function, params):
+        # Images standardized by the cache
+        standardized = []
+        def counting_function(image):
+            standardized.append(image)
+            return standardize_function(image)
 
+        try:
+            with tempfile.TemporaryDirectory() as work_dir:
+                copy_dir = os.path.join(work_dir, "images")
+                cache_dir = os.path.join(work_dir, "cache")
+                for im_type in helpers.IMAGE_TYPES:
+                    os.makedirs(os.path.join(copy_dir, im_type))
+                    for file in sorted(glob.glob(os.path.join(image_dir, im_type, "*")))[:4]:
+                        shutil.copy(file, os.path.join(copy_dir, im_type))
+                expected = [(standardize_function(im), label) for im, label in helpers.load_dataset(copy_dir)]
+
+                def load(load_params):
+                    del standardized[:]
+                    images, labels = helpers.load_standardized_dataset(copy_dir, cache_dir, counting_function, load_params)
+                    self.assertEqual([label for im, label in expected], list(labels))
+                    self.assertTrue(all(np.array_equal(a, b) for (a, _), b in zip(expected, images)))
+                    return len(standardized)
+
+                self.assertEqual(len(expected), load(params))
+                self.assertEqual(0, load(params))
+                changed_params = dict(params, test_changed=True)
+                self.assertEqual(len(expected), load(changed_params))
+                self.assertEqual(len(expected), load(params))
+
+                # A modified file is standardized again, the others come from the cache
+                file = sorted(glob.glob(os.path.join(copy_dir, "yellow", "*")))[0]
+                stat = os.stat(file)
+                os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+                self.assertEqual(1, load(params))
+                self.assertEqual(0, load(params))
+
+                # A run stopped before replacing the index leaves its images file behind, the index still
+                # reads its own images
+                np.save(os.path.join(cache_dir, "images-stopped.npy"), np.zeros((3, 32, 32, 3), dtype=np.uint8))
+                self.assertEqual(0, load(params))
+                # An index whose images file does not have one row per source is rebuilt
+                index_file = os.path.join(cache_dir, "index.json")
+                with open(index_file) as f:
+                    index = json.load(f)
+                with open(index_file, "w") as f:
+                    json.dump(dict(index, sources=index["sources"][:-1]), f)
+                self.assertEqual(len(expected), load(params))
+                self.assertEqual(1, len(glob.glob(os.path.join(cache_dir, "images*.npy"))))
+
+        except self.failureException as e:
+            print_fail()
+            print("The standardized images cache was not rebuilt as expected.")
+            print('\n'+str(e))
+            return
+
+        print_pass()
+
+
+    # Tests that the batch feature and label functions give the same results as the per-image ones
+    # on a list of standardized images
+    def test_batch_functions(self, create_feature, create_features_batch, estimate_label, estimate_labels_batch, images):
+        try:
+            images = np.asarray(images)
+            features = create_features_batch(images)
+            self.assertEqual((len(images), 3), features.shape)
+            self.assertTrue(np.allclose([create_feature(im) for im in images], features))
+            self.assertEqual([estimate_label(im) for im in images], estimate_labels_batch(images).tolist())
+
+        except self.failureException as e:
+            print_fail()
+            print("The batch functions do not match the per-image functions.")
+            print('\n'+str(e))
+            return
+
+        print_pass()
+
+
+    # Tests that DropOldestQueue drops and counts the oldest items when it is full, and that a closed
+    # queue hands out its remaining items before the empty batch that stops the consumer
+    def test_drop_oldest_queue(self):
+        try:
+            queue = streaming.DropOldestQueue(3)
+            for item in range(5):
+                queue.put(item)
+            self.assertEqual(2, queue.dropped)
+            self.assertEqual(3, len(queue))
+            self.assertEqual([2, 3], queue.get_batch(2))
+
+            queue.close()
+            self.assertRaises(ValueError, queue.put, 5)
+            self.assertEqual([4], queue.get_batch(10, timeout=1))
+            self.assertEqual([], queue.get_batch(10, timeout=1))
+            self.assertEqual(2, queue.dropped)
+
+            # A consumer waiting on an empty queue is woken up by close
+            queue = streaming.DropOldestQueue(3)
+            batches = []
+            consumer = threading.Thread(target=lambda: batches.append(queue.get_batch(10)), daemon=True)
+            consumer.start()
+            queue.close()
+            consumer.join(5)
+            self.assertFalse(consumer.is_alive())
+            self.assertEqual([[]], batches)
+
+        except self.failureException as e:
+            print_fail()
+            print("DropOldestQueue did not drop or drain its items as expected.")
+            print('\n'+str(e))
+            return
+
+        print_pass()
+
+
+    # Tests that StreamingClassifier classifies the frames of synthetic_frames in micro batches with the same
+    # labels as estimate_label, accounts for every frame (classified or dropped) and raises the errors of
+    # the consumer thread from stop
+    def test_streaming_classifier(self, image_dir, standardize_function, estimate_label, estimate_labels_batch):
+        # (frame_id, label) of the classified frames, in callback order, and the size of every batch
+        labels = []
+        batch_sizes = []
+        def counting_function(images):
+            batch_sizes.append(len(images))
+            return estimate_labels_batch(images)
+
+        try:
+            frames = {}
+            classifier = streaming.StreamingClassifier(standardize_function, counting_function, queue_size=8, batch_size=4,
+                                                       callback=lambda frame_id, label, latency: labels.append((frame_id, label)))
+            with classifier:
+                for frame_id, frame, label in streaming.synthetic_frames(image_dir, fps=None, n_frames=400):
+                    self.assertIn(label, helpers.IMAGE_TYPES)
+                    frames[frame_id] = frame
+                    classifier.submit(frame, frame_id)
+            self.assertEqual(list(range(400)), sorted(frames))
+
+            stats = classifier.stats()
+            self.assertEqual(400, stats['submitted'])
+            self.assertEqual(stats['submitted'], stats['classified'] + stats['dropped'])
+            self.assertEqual(stats['classified'], len(labels))
+            self.assertEqual(stats['batches'], len(batch_sizes))
+            self.assertTrue(all(1 <= size <= 4 for size in batch_sizes))
+            self.assertLessEqual(stats['p50_ms'], stats['p90_ms'])
+            self.assertLessEqual(stats['p90_ms'], stats['p99_ms'])
+            self.assertLessEqual(stats['p99_ms'], stats['max_ms'])
+            # Frames come out in the order they were submitted, with the labels of estimate_label
+            self.assertEqual(sorted(frame_id for frame_id, label in labels), [frame_id for frame_id, label in labels])
+            for frame_id, label in labels:
+                self.assertEqual(estimate_label(standardize_function(frames[frame_id])), label)
+
+            # An error of the consumer thread stops the classification and is raised by stop
+            def failing_function(images):
+                raise RuntimeError("estimate failed")
+            classifier = streaming.StreamingClassifier(standardize_function, failing_function)
+            with self.assertRaises(RuntimeError):
+                with classifier:
+                    classifier.submit(frames[0])
+                    classifier.thread.join(5)
+            self.assertEqual(0, classifier.stats()['classified'])
+
+        except self.failureException as e:
+            print_fail()
+            print("StreamingClassifier did not classify the frames as expected.")
+            print('\n'+str(e))
+            return
+
+        print_pass()
+
+
+    # Tests that region_means over the summed-area tables gives the features of create_feature, whose
+    # regions are the (y1, y2) row bands of rows, and that regions outside the images are refused
+    def test_region_means(self, create_feature, rows, images):
+        try:
+            images = np.asarray(images)
+            tables = region_features.summed_area_tables(images)
+            width = images.shape[2]
+            means = region_features.region_means(tables, [(y1, y2, 0, width) for y1, y2 in rows])
+            self.assertTrue(np.allclose([create_feature(im) for im in images], means))
+            self.assertTrue(np.allclose(means[:1], region_features.region_means(
+                region_features.summed_area_tables(images[0]), [(y1, y2, 0, width) for y1, y2 in rows])))
+            self.assertRaises(ValueError, region_features.region_means, tables, [(0, images.shape[1] + 1, 0, width)])
+            self.assertRaises(ValueError, region_features.region_means, tables, [(4, 4, 0, width)])
+
+        except self.failureException as e:
+            print_fail()
+            print("region_means does not match create_feature.")
+            print('\n'+str(e))
+            return
+
+        print_pass()